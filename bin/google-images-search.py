@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
 import argparse
-import json
-import tempfile
 from pathlib import Path
 
 import qloader
+from qloader.args import path_or_tempdir
 
 
 def main(args: argparse.Namespace) -> None:
-    images_metadata = qloader.run(
+    manifests = args.manifest or [args.output_path.joinpath("manifest.json")]
+    qloader.run(
         endpoint="google-images",
         query_terms=args.query,
         output_path=args.output_path,
@@ -16,13 +16,13 @@ def main(args: argparse.Namespace) -> None:
         max_items=args.max_items,
         language=args.language,
         browser=args.browser,
+        browserless=args.browserless,
+        browser_profile=args.browser_profile,
         track_related=args.track_related,
+        manifest_file=manifests,
     )
-    manifest_output = args.output_path.joinpath("manifest.json")
-    manifest_output.write_text(
-        json.dumps([im.data for im in images_metadata], indent=2)
-    )
-    print(f"wrote {manifest_output}")
+    for manifest in manifests:
+        print(f"wrote {manifest}")
 
 
 if __name__ == "__main__":
@@ -32,15 +32,37 @@ if __name__ == "__main__":
     parser.add_argument("--language", type=str, help="language of query", default="en")
     parser.add_argument(
         "--output-path",
-        type=Path,
-        help="path to save output",
-        default=Path(tempfile.TemporaryDirectory().name),
+        type=path_or_tempdir,
+        help="path to save output, defaults to a new temporary directory",
+        default="",
     )
     parser.add_argument(
         "--max-items", type=int, help="number of images to aim for", default=100
     )
     parser.add_argument(
-        "--browser", type=str, help="Browser to use for searching", default="Firefox"
+        "--browser",
+        type=str,
+        help="Browser to use for searching (Firefox when not set), setting it always uses the browser",
+    )
+    parser.add_argument(
+        "--browserless",
+        action="store_true",
+        default=None,
+        help="Always search over plain HTTP, without a browser",
+    )
+    parser.add_argument(
+        "--browser-profile",
+        type=str,
+        choices=["default", "lean", "lean-no-images"],
+        help="Lean profiles block resources the scraper does not need (see README)",
+        default="default",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        action="append",
+        help="manifest to write, may be repeated. .sqlite/.db and .parquet append to a shared dataset, "
+        "anything else is written as JSON. Defaults to manifest.json in the output path",
     )
     parser.add_argument(
         "--track-related",
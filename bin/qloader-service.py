@@ -0,0 +1,5 @@
+#!/usr/bin/env python3
+from qloader.service import get_parser, main
+
+if __name__ == "__main__":
+    main(get_parser().parse_args())
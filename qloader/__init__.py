@@ -1 +1,7 @@
-from .query import run
+def __getattr__(name: str):
+    # run is resolved on first access so that `import qloader` does not pay for selenium and friends
+    if name == "run":
+        from .query import run
+
+        return run
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
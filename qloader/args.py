@@ -33,6 +33,14 @@ def env_default(envvar):
     return wrapper
 
 
+def path_or_tempdir(value: str) -> Path:
+    """
+    argparse type for output paths, an empty value creates a fresh temporary directory.
+    Used with a "" default so the directory is only created when the parsed default is actually used.
+    """
+    return Path(value) if value else Path(tempfile.mkdtemp(prefix="qloader-"))
+
+
 def get_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
 
@@ -41,7 +49,8 @@ def get_parser() -> argparse.ArgumentParser:
         type=str,
         action=env_default("QLOADER_ENDPOINT"),
         default="google-images",
-        help="The endpoint to query, only google-images is currently implemented",
+        help="The endpoint to query: google-images (browser), google-images-http (plain HTTP), "
+        "or an endpoint installed under the qloader.endpoints entry point group",
     )
     parser.add_argument(
         "--metadata-path",
@@ -52,10 +61,11 @@ def get_parser() -> argparse.ArgumentParser:
     )
     parser.add_argument(
         "--output-path",
-        type=Path,
+        type=path_or_tempdir,
         action=env_default("QLOADER_OUTPUT_PATH"),
-        default=Path(tempfile.TemporaryDirectory().name),
-        help="Where to store results locally",
+        required=False,
+        default="",
+        help="Where to store results locally, defaults to a new temporary directory",
     )
     parser.add_argument(
         "--query-terms",
@@ -82,8 +92,21 @@ def get_parser() -> argparse.ArgumentParser:
         "--browser",
         type=str,
         action=env_default("QLOADER_BROWSER"),
-        default="Firefox",
-        help="Browser to use for webdriver, if needed",
+        required=False,
+        help="Browser to use for webdriver (Firefox when not set), setting it always uses the browser",
+    )
+    parser.add_argument(
+        "--browserless",
+        action="store_true",
+        default=None,
+        help="Always use the plain HTTP backend, without a browser",
+    )
+    parser.add_argument(
+        "--browser-profile",
+        type=str,
+        action=env_default("QLOADER_BROWSER_PROFILE"),
+        default="default",
+        help="Browser profile: default, lean or lean-no-images (see README)",
     )
 
     return parser
@@ -0,0 +1,85 @@
+"""
+Memory bounds between the scraping, download and decode stages.
+
+get_google_images stops pulling image links from the scraper (so the browser stops scrolling and clicking)
+while max_queued_urls links are still being processed or waiting to be yielded. Downloads and decoded image
+bytes are bounded across primary and related images, so RSS stays flat regardless of max_items.
+"""
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+
+
+class BoundedStage:
+    """
+    Counting gate with a fixed capacity, reserve blocks while the stage is full.
+    A single reservation larger than the capacity waits for the stage to drain instead of deadlocking.
+    """
+
+    def __init__(self, name: str, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError(f"{name} capacity must be at least 1, got {capacity}")
+        self.name = name
+        self.capacity = capacity
+        self.occupancy = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, amount: int = 1) -> int:
+        amount = min(amount, self.capacity)
+        with self._condition:
+            self._condition.wait_for(lambda: self.occupancy + amount <= self.capacity)
+            self.occupancy += amount
+            self.peak = max(self.peak, self.occupancy)
+        return amount
+
+    def release(self, amount: int = 1) -> None:
+        with self._condition:
+            self.occupancy -= min(amount, self.capacity)
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, amount: int = 1) -> Generator[None, None, None]:
+        acquired = self.acquire(amount)
+        try:
+            yield
+        finally:
+            self.release(acquired)
+
+    @property
+    def saturated(self) -> bool:
+        return self.occupancy >= self.capacity
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "occupancy": self.occupancy,
+            "capacity": self.capacity,
+            "peak": self.peak,
+        }
+
+
+class PipelineLimits:
+    """
+    Limits for one query's ingest path, pass the same instance around to observe its occupancy while it runs
+    """
+
+    def __init__(
+        self,
+        max_queued_urls: int = 32,
+        max_inflight_downloads: int = 8,
+        max_inflight_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.queued_urls = BoundedStage("queued_urls", max_queued_urls)
+        self.downloads = BoundedStage("downloads", max_inflight_downloads)
+        self.decoded_bytes = BoundedStage("decoded_bytes", max_inflight_bytes)
+
+    @property
+    def stages(self) -> List[BoundedStage]:
+        return [self.queued_urls, self.downloads, self.decoded_bytes]
+
+    def saturated(self) -> bool:
+        return any(stage.saturated for stage in self.stages)
+
+    def occupancy(self) -> Dict[str, Dict[str, int]]:
+        return {stage.name: stage.stats() for stage in self.stages}
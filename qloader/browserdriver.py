@@ -1,11 +1,15 @@
 from __future__ import annotations
+import logging
 import os
 import random
 import time
 import hashlib
+import heapq
 import tempfile
+import threading
 from collections import defaultdict
 from pathlib import Path
+from urllib.parse import quote
 
 import selenium
 from selenium import webdriver
@@ -14,17 +18,110 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.firefox.options import Options as FirefoxOptions
 from selenium.webdriver.chrome.options import Options as ChromeOptions
 
-from .logger import get_logger
+from .httpsearch import google_search_url
+from .logger import get_logger, log_payload
+from .monitor import ErrorRateMonitor, UnacceptableErrorRateError
+
+# Browser profiles trade rendering fidelity for CPU and bandwidth, the scraper only needs URLs from the DOM.
+#
+# default:         a stock browser, compatible with every extraction mode.
+# lean:            small fixed viewport, no caches, extensions, web fonts, media autoplay, prefetching or
+#                  known ad/tracker hosts. Images still load, so it is compatible with every extraction mode,
+#                  including the full-size preview url that google only swaps in once the preview has loaded.
+# lean-no-images:  lean plus image loading and decoding disabled. Related image urls (track_related) and
+#                  thumbnail urls are read from attributes and are unaffected, but the primary image is often
+#                  only the encrypted-tbn0.gstatic.com thumbnail since the full-size preview never loads.
+#                  Use it when thumbnail quality primary images are acceptable.
+BROWSER_PROFILES = ["default", "lean", "lean-no-images"]
+
+LEAN_VIEWPORT = (1024, 768)
+
+# ad, tracker and other third-party hosts that the google images results page pulls in for no benefit to us
+BLOCKED_HOSTS = [
+    "doubleclick.net",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "google-analytics.com",
+    "googletagmanager.com",
+    "adservice.google.com",
+    "fonts.gstatic.com",
+    "fonts.googleapis.com",
+]
+
+# requests to blocked hosts are sent to this proxy, nothing listens on the discard port so they fail immediately
+BLACKHOLE_PROXY = "127.0.0.1:9"
+
+
+def blocked_hosts_pac(hosts: List[str]) -> str:
+    """
+    Proxy auto-config (as a data: url) that blackholes hosts and all of their subdomains, the Firefox
+    equivalent of Chrome's "MAP *.host ~NOTFOUND" resolver rules. network.dns.localDomains only matches exact hosts.
+    """
+    conditions = " || ".join(
+        f'host == "{host}" || dnsDomainIs(host, ".{host}")' for host in hosts
+    )
+    script = (
+        "function FindProxyForURL(url, host) {"
+        f' if ({conditions}) return "PROXY {BLACKHOLE_PROXY}";'
+        ' return "DIRECT"; }'
+    )
+    return "data:application/x-ns-proxy-autoconfig," + quote(script)
+
+
+LEAN_FIREFOX_PREFERENCES = {
+    "browser.cache.disk.enable": False,
+    "browser.cache.memory.enable": False,
+    "browser.cache.offline.enable": False,
+    "network.http.use-cache": False,
+    "extensions.enabledScopes": 0,
+    "gfx.downloadable_fonts.enabled": False,
+    "browser.display.use_document_fonts": 0,
+    "media.autoplay.default": 5,
+    "network.prefetch-next": False,
+    "network.dns.disablePrefetch": True,
+    "privacy.trackingprotection.enabled": True,
+    "network.proxy.type": 2,
+    "network.proxy.autoconfig_url": blocked_hosts_pac(BLOCKED_HOSTS),
+    "toolkit.cosmeticAnimations.enabled": False,
+}
+
+LEAN_CHROME_ARGUMENTS = [
+    f"--window-size={LEAN_VIEWPORT[0]},{LEAN_VIEWPORT[1]}",
+    "--disable-extensions",
+    "--disable-component-extensions-with-background-pages",
+    "--disk-cache-size=1",
+    "--media-cache-size=1",
+    "--disable-remote-fonts",
+    "--autoplay-policy=user-gesture-required",
+    "--mute-audio",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--host-resolver-rules="
+    + ", ".join(
+        f"MAP *.{host} ~NOTFOUND, MAP {host} ~NOTFOUND" for host in BLOCKED_HOSTS
+    ),
+]
 
 
 def get_browser_options(
-    browser: str, keep_head: bool = False, use_proxy: Optional[str] = None
+    browser: str,
+    keep_head: bool = False,
+    use_proxy: Optional[str] = None,
+    profile: str = "default",
 ) -> Any:
+    """
+    Build webdriver options for browser, see BROWSER_PROFILES for the available profiles
+    """
     try:
         options = {"Firefox": FirefoxOptions(), "Chrome": ChromeOptions()}[browser]
     except KeyError:
         raise ValueError(f"Unknown browser '{browser}'")
 
+    if profile not in BROWSER_PROFILES:
+        raise ValueError(f"Unknown browser profile '{profile}'")
+
     if not keep_head:
         options.add_argument("--headless")
 
@@ -34,14 +131,51 @@ def get_browser_options(
     if use_proxy is not None:
         options.add_argument(f"--proxy-server={use_proxy}")
 
+    if profile.startswith("lean"):
+        block_images = profile == "lean-no-images"
+        if browser == "Firefox":
+            options.add_argument(f"--width={LEAN_VIEWPORT[0]}")
+            options.add_argument(f"--height={LEAN_VIEWPORT[1]}")
+            for key, value in LEAN_FIREFOX_PREFERENCES.items():
+                options.set_preference(key, value)
+            if block_images:
+                options.set_preference("permissions.default.image", 2)
+        else:
+            for argument in LEAN_CHROME_ARGUMENTS:
+                options.add_argument(argument)
+            if block_images:
+                options.add_argument("--blink-settings=imagesEnabled=false")
+                options.add_experimental_option(
+                    "prefs", {"profile.managed_default_content_settings.images": 2}
+                )
+
     return options
 
 
-def random_sleep(min_time: float) -> None:
+def fuzz(min_time: float) -> float:
     """
     Fuzz wait times between [min_time, min_time*2]
     """
-    time.sleep(min_time + (min_time * random.random()))
+    return min_time + (min_time * random.random())
+
+
+def random_sleep(min_time: float, cancel: Optional[threading.Event] = None) -> bool:
+    """
+    Sleep for a fuzzed min_time, returns True as soon as cancel is set
+    """
+    if cancel is None:
+        time.sleep(fuzz(min_time))
+        return False
+    return cancel.wait(fuzz(min_time))
+
+
+class Pause:
+    """
+    Yielded by scrape_google_images where it needs to wait on the page
+    """
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
 
 
 class NoImagesInWebElementError(Exception):
@@ -65,7 +199,7 @@ def pick_best_actual_image(actual_images: List[WebElement]) -> WebElement:
                 # this error is often accompanied by: Message: stale element reference: element is not attached to the page document
                 # could be some race condition, or maybe the page is changing between the actual_images getting populated and this method getting called
                 # either way - we will continue here and raise an error later if there are no images to choose from
-                log.warning(f"skipping image due to stale reference: {exc}")
+                log.warning("skipping image due to stale reference: %s", exc)
                 continue
         if len(scores) == 0:
             raise NoImagesInWebElementError()
@@ -77,7 +211,32 @@ def pick_best_actual_image(actual_images: List[WebElement]) -> WebElement:
         return actual_images[random.choice(top_scorers)]
 
 
-def fetch_google_image_urls(
+def pick_alternate_src(
+    thumbnail: WebElement, candidates: List[WebElement], chosen_src: str
+) -> Optional[str]:
+    """
+    Pick an alternate to hedge slow origin downloads with. The clicked thumbnail is the same image and is
+    served quickly by gstatic, so it is preferred. The preview candidates may belong to a neighbouring panel
+    and are only a fallback, gstatic thumbnails first.
+    """
+    alternates = list()
+    for candidate in [thumbnail] + candidates:
+        try:
+            src = candidate.get_attribute("src")
+        except StaleElementReferenceException:
+            continue
+        if src and src != chosen_src and src.startswith(("http", "data:image")):
+            if candidate is thumbnail:
+                return src
+            alternates.append(src)
+
+    for src in alternates:
+        if "encrypted-tbn0.gstatic.com" in src:
+            return src
+    return alternates[0] if alternates else None
+
+
+def scrape_google_images(
     query: str,
     driver: WebDriver,
     sleep_between_interactions: float = 0.5,
@@ -85,40 +244,46 @@ def fetch_google_image_urls(
     extra_query_params: Optional[Dict[str, str]] = None,
     track_related: bool = False,
     exact: bool = False,
-) -> List(Dict[str, str]):
+    monitor: Optional[ErrorRateMonitor] = None,
+) -> Generator[Union[Pause, Dict[str, str]], None, None]:
     """
     Accumulate a set of image urls.
     The find_elements_by_css_selector approach for interacting with the page.
     feels a little bit brittle, it's possible these values could change.
+
+    Instead of sleeping between interactions this yields a Pause, see fetch_google_image_urls for a consumer
+    that simply sleeps and fetch_google_image_urls_in_tabs for one that drives other tabs meanwhile.
+
+    Every thumbnail is recorded as a scrape attempt on monitor, the scrape aborts once too many of them fail.
     """
 
     log = get_logger("fetch_google_image_urls")
-    random_sleep(sleep_between_interactions)
+    yield Pause(sleep_between_interactions)
+
+    def scrape_failed(exc: Exception) -> None:
+        if monitor is not None:
+            monitor.record("scrape", exc)
+            if monitor.exceeded("scrape"):
+                log_payload(
+                    log,
+                    "page_source",
+                    lambda: driver.page_source,
+                    level=logging.WARNING,
+                )
+                monitor.check(["scrape"])
 
     def scroll_to_end(driver):
         driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        random_sleep(sleep_between_interactions)
-
-    query_params = {
-        "safe": "off",
-        "tbm": "isch",
-        "q": f"+{query}" if not exact else f'+"{query}"',
-        "lr": f"lang_{language}",
-    }
-
-    if extra_query_params is not None:
-        query_params.update(extra_query_params)
-
-    query_params_str = "&".join([f"{key}={val}" for key, val in query_params.items()])
+        yield Pause(sleep_between_interactions)
 
     # build the google query
-    search_url = f"https://www.google.com/search?{query_params_str}"
+    search_url = google_search_url(query, language, extra_query_params, exact)
 
     log.info(f"searching: {search_url}")
 
     # load the page
     driver.get(search_url)
-    random_sleep(sleep_between_interactions)
+    yield Pause(sleep_between_interactions)
 
     image_links = list()
     results_start = 0
@@ -132,7 +297,10 @@ def fetch_google_image_urls(
         number_results = len(thumbnail_results)
 
         log.debug(
-            f"Found: {number_results} search results. Extracting links from {results_start}:{number_results}"
+            "Found: %d search results. Extracting links from %d:%d",
+            number_results,
+            results_start,
+            number_results,
         )
         if results_start == number_results:
             breakpoints += 1
@@ -143,23 +311,23 @@ def fetch_google_image_urls(
             # try to click every thumbnail such that we can get the real image behind it
             try:
                 img.click()
-                random_sleep(sleep_between_interactions)
-            except Exception:
+                yield Pause(sleep_between_interactions)
+            except Exception as exc:
+                scrape_failed(exc)
                 continue
 
             # extract image urls
             try:
-                actual_image = pick_best_actual_image(
-                    driver.find_elements(By.CSS_SELECTOR, "img.n3VNCb")
-                )
+                candidates = driver.find_elements(By.CSS_SELECTOR, "img.n3VNCb")
+                actual_image = pick_best_actual_image(candidates)
             except NoImagesInWebElementError:
                 try:
-                    actual_image = pick_best_actual_image(
-                        driver.find_elements(By.CSS_SELECTOR, "img.r48jcc")
-                    )
+                    candidates = driver.find_elements(By.CSS_SELECTOR, "img.r48jcc")
+                    actual_image = pick_best_actual_image(candidates)
                     log.debug("found image at alternate tag")
                 except NoImagesInWebElementError as exc:
                     log.debug("skipping empty element")
+                    scrape_failed(exc)
                     skipped_empty_elements += 1
                     if skipped_empty_elements >= 10:
                         page_source_file = Path(tempfile.NamedTemporaryFile().name)
@@ -175,10 +343,19 @@ def fetch_google_image_urls(
                 ) and "http" in actual_image.get_attribute("src"):
                     image_link.update({"src": actual_image.get_attribute("src")})
                     image_link.update({"alt": actual_image.get_attribute("alt")})
+                    image_link.update(
+                        {
+                            "alternate_src": pick_alternate_src(
+                                img, candidates, image_link["src"]
+                            )
+                        }
+                    )
                 else:
+                    scrape_failed(NoImagesInWebElementError("preview has no http src"))
                     continue
             except StaleElementReferenceException as exc:
-                log.warning(f"skipping image due to stale reference: {exc}")
+                log.warning("skipping image due to stale reference: %s", exc)
+                scrape_failed(exc)
                 continue
 
             if track_related:
@@ -204,6 +381,8 @@ def fetch_google_image_urls(
 
                 image_link["related_images"] = related_images
 
+            if monitor is not None:
+                monitor.record("scrape")
             result_id = hashlib.md5(
                 f"{image_link['alt']}{image_link['src']}".encode("utf-8")
             ).hexdigest()
@@ -212,10 +391,10 @@ def fetch_google_image_urls(
                 results_seen.append(result_id)
 
         else:
-            log.debug(f"Found: {len(image_links)} image links, looking for more ...")
-            random_sleep(sleep_between_interactions)
+            log.debug("Found: %d image links, looking for more ...", len(image_links))
+            yield Pause(sleep_between_interactions)
 
-            scroll_to_end(driver)
+            yield from scroll_to_end(driver)
 
             # look for the More Results or Load More Anyway or Cookie Accept button
             try:
@@ -242,25 +421,145 @@ def fetch_google_image_urls(
                 try:
                     driver.execute_script("document.querySelector('.r0zKGf').click();")
                     log.debug("clicked See More Anyway")
-                    random_sleep(sleep_between_interactions)
+                    yield Pause(sleep_between_interactions)
                 except selenium.common.exceptions.NoSuchElementException:
                     pass
             elif accept_cookies_button:
                 accept_cookies_button.click()
                 log.debug("accepted cookies")
-                random_sleep(sleep_between_interactions * 2)
+                yield Pause(sleep_between_interactions * 2)
             elif load_more_button:
                 driver.execute_script("document.querySelector('.mye4qd').click();")
                 log.debug("clicked More Results")
-                random_sleep(sleep_between_interactions * 2)
+                yield Pause(sleep_between_interactions * 2)
             else:
-                log.debug(driver.page_source)
+                log_payload(log, "page_source", lambda: driver.page_source)
                 log.warning(
                     f"No path for more images found, scrolling to bottom of page"
                 )
-            scroll_to_end(driver)
+            yield from scroll_to_end(driver)
 
         # move the result startpoint further down
         results_start = len(thumbnail_results)
 
-    log.debug(f"scraped for {int(time.time() - start)} seconds")
+    log.debug("scraped for %d seconds", time.time() - start)
+
+
+def fetch_google_image_urls(
+    query: str,
+    driver: WebDriver,
+    sleep_between_interactions: float = 0.5,
+    language: str = "en",
+    extra_query_params: Optional[Dict[str, str]] = None,
+    track_related: bool = False,
+    exact: bool = False,
+    monitor: Optional[ErrorRateMonitor] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Generator[Dict[str, str], None, None]:
+    """
+    Yield image links from a single tab, sleeping whenever the page needs time. Stops at the first pause
+    after cancel is set.
+    """
+    for item in scrape_google_images(
+        query=query,
+        driver=driver,
+        sleep_between_interactions=sleep_between_interactions,
+        language=language,
+        extra_query_params=extra_query_params,
+        track_related=track_related,
+        exact=exact,
+        monitor=monitor,
+    ):
+        if isinstance(item, Pause):
+            if random_sleep(item.seconds, cancel):
+                return
+        else:
+            yield item
+
+
+def fetch_google_image_urls_in_tabs(
+    driver: WebDriver,
+    queries: List[Dict[str, Any]],
+    sleep_between_interactions: float = 0.5,
+    monitor: Optional[ErrorRateMonitor] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Generator[Tuple[int, Dict[str, str]], None, None]:
+    """
+    Run one scrape per tab of a single WebDriver session and yield (tab, image link) from all of them as one stream.
+    Each entry in queries holds scrape_google_images keyword arguments (query, language, extra_query_params, ...).
+
+    Whenever a tab would sleep waiting on the page, the scheduler switches to whichever tab is ready soonest,
+    so the browser is kept busy while individual tabs wait on the network. Image links already yielded by
+    another tab are skipped. A failing tab is dropped, its error is re-raised only if no tab yielded anything.
+    All tabs share monitor, an unacceptable scrape error rate aborts every tab. Setting cancel stops every tab
+    at its next pause.
+    """
+    log = get_logger("fetch_google_image_urls_in_tabs")
+
+    handles = [driver.current_window_handle]
+    for _ in queries[1:]:
+        driver.switch_to.new_window("tab")
+        handles.append(driver.current_window_handle)
+    current_handle = handles[-1]
+
+    scrapers = {
+        tab: scrape_google_images(
+            driver=driver,
+            sleep_between_interactions=sleep_between_interactions,
+            monitor=monitor,
+            **query,
+        )
+        for tab, query in enumerate(queries)
+    }
+    ready = [(time.time(), tab) for tab in scrapers]
+    heapq.heapify(ready)
+    seen_srcs = set()
+    error = None
+    try:
+        while ready:
+            ready_at, tab = heapq.heappop(ready)
+            delay = ready_at - time.time()
+            if cancel is None:
+                if delay > 0:
+                    time.sleep(delay)
+            elif cancel.wait(max(0, delay)):
+                log.debug("cancelled")
+                return
+
+            if handles[tab] != current_handle:
+                driver.switch_to.window(handles[tab])
+                current_handle = handles[tab]
+
+            try:
+                item = next(scrapers[tab])
+            except StopIteration:
+                log.debug("tab %d finished", tab)
+                continue
+            except UnacceptableErrorRateError:
+                raise
+            except Exception as exc:
+                log.warning("dropping tab %d: %s", tab, exc)
+                error = exc
+                continue
+
+            if isinstance(item, Pause):
+                heapq.heappush(ready, (time.time() + fuzz(item.seconds), tab))
+                continue
+
+            heapq.heappush(ready, (time.time(), tab))
+            if item["src"] in seen_srcs:
+                continue
+            seen_srcs.add(item["src"])
+            yield tab, item
+
+        if error is not None and len(seen_srcs) == 0:
+            raise error
+    finally:
+        # close the extra tabs, the session may be reused for another query
+        for handle in handles[1:]:
+            try:
+                driver.switch_to.window(handle)
+                driver.close()
+            except Exception as exc:
+                log.debug("could not close tab %s: %s", handle, exc)
+        driver.switch_to.window(handles[0])
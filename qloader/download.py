@@ -0,0 +1,168 @@
+"""
+Image downloads bounded by a per-image latency budget.
+
+A handful of slow origin servers dominate the tail of a query, so when the origin
+has not answered within a percentile of recently observed download times a hedged
+request is sent to an alternate candidate (usually the gstatic thumbnail).
+Whichever finishes first wins.
+"""
+from __future__ import annotations
+
+import base64
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from dataclasses import dataclass
+from urllib.parse import unquote_to_bytes
+
+from .logger import get_logger
+
+DOWNLOAD_TIMEOUT = 5
+
+
+class LatencyBudget:
+    """
+    Derives the hedging threshold from a percentile of recent origin download times
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.9,
+        window: int = 200,
+        min_samples: int = 10,
+        initial: float = 1.0,
+        floor: float = 0.1,
+    ) -> None:
+        if not 0 < percentile <= 1:
+            raise ValueError(f"percentile must be in (0, 1], got {percentile}")
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial = initial
+        self.floor = floor
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def threshold(self) -> float:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return self.initial
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+        return max(self.floor, ordered[index])
+
+
+@dataclass
+class FetchResult:
+    content: bytes
+    url: str
+    source: str
+    hedged: bool
+    seconds: float
+    # response headers of the winning download, None for data: URIs
+    headers: Optional[Mapping[str, str]] = None
+
+
+def fetch_content(
+    url: str, timeout: float = DOWNLOAD_TIMEOUT
+) -> Tuple[bytes, Optional[Mapping[str, str]]]:
+    """
+    Download the body and response headers behind url,
+    inline data: URIs (used by google for the first thumbnails) are decoded directly and have no headers
+    """
+    if url.startswith("data:"):
+        header, _, payload = url.partition(",")
+        if header.endswith(";base64"):
+            return base64.b64decode(payload), None
+        return unquote_to_bytes(payload), None
+
+    import requests
+
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.content, response.headers
+
+
+def _when_done(futures: List[Future], callback: Callable[[], None]) -> None:
+    """
+    Call callback once every future is done, right away when there are none
+    """
+    remaining = len(futures)
+    lock = threading.Lock()
+
+    def done(_: Future) -> None:
+        nonlocal remaining
+        with lock:
+            remaining -= 1
+            last = remaining == 0
+        if last:
+            callback()
+
+    if remaining == 0:
+        return callback()
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def hedged_fetch(
+    url: str,
+    alternate_url: Optional[str] = None,
+    budget: Optional[LatencyBudget] = None,
+    executor: Optional[Executor] = None,
+    release: Optional[Callable[[], None]] = None,
+) -> FetchResult:
+    """
+    Fetch url, sending a hedged request to alternate_url if the origin has not finished within the budget.
+    release is called once every request has finished, a losing request keeps downloading after the winner returned.
+    """
+    log = get_logger("hedged_fetch")
+    start = time.time()
+    requests = list()
+    try:
+        if alternate_url is None or budget is None or executor is None:
+            content, headers = fetch_content(url)
+            seconds = time.time() - start
+            if budget is not None:
+                budget.record(seconds)
+            return FetchResult(content, url, "origin", False, seconds, headers)
+
+        threshold = budget.threshold()
+        origin = executor.submit(fetch_content, url)
+        requests.append(origin)
+        # the budget tracks the origin, also when it finishes in the background after the alternate won
+        origin.add_done_callback(lambda _: budget.record(time.time() - start))
+        done, _ = wait([origin], timeout=threshold)
+        if origin in done and origin.exception() is None:
+            seconds = time.time() - start
+            content, headers = origin.result()
+            return FetchResult(content, url, "origin", False, seconds, headers)
+
+        log.debug(
+            "origin failed or exceeded %.2fs budget, hedging with alternate for %s",
+            threshold,
+            url,
+        )
+        alternate = executor.submit(fetch_content, alternate_url)
+        requests.append(alternate)
+        sources = {origin: ("origin", url), alternate: ("alternate", alternate_url)}
+        pending = {alternate} if origin in done else {origin, alternate}
+        error = origin.exception() if origin in done else None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                seconds = time.time() - start
+                source, source_url = sources[future]
+                content, headers = future.result()
+                return FetchResult(content, source_url, source, True, seconds, headers)
+
+        raise error
+    finally:
+        if release is not None:
+            _when_done(requests, release)
@@ -0,0 +1,281 @@
+"""
+Endpoint registry.
+
+An endpoint turns a query into candidate image links: dicts with "src" and "alt", and optionally
+"alternate_src" (hedging candidate) and "related_images". Downloading, deduplication and manifests
+are shared by every endpoint (see query.get_images).
+
+Endpoints are registered with the register_endpoint decorator, or by other packages through the
+"qloader.endpoints" entry point group, e.g. in pyproject.toml:
+
+    [tool.poetry.plugins."qloader.endpoints"]
+    "my-endpoint" = "my_package.endpoints:MyEndpoint"
+"""
+from __future__ import annotations
+
+from contextlib import nullcontext
+
+from .logger import get_logger
+
+ENTRY_POINT_GROUP = "qloader.endpoints"
+
+ENDPOINTS = dict()
+
+
+class UnimplementedEndpointError(Exception):
+    pass
+
+
+def register_endpoint(name: str) -> Callable[[Type[Endpoint]], Type[Endpoint]]:
+    """
+    Class decorator registering an Endpoint under name
+    """
+
+    def decorator(endpoint_class: Type[Endpoint]) -> Type[Endpoint]:
+        endpoint_class.name = name
+        ENDPOINTS[name] = endpoint_class
+        return endpoint_class
+
+    return decorator
+
+
+def get_endpoint(name: str) -> Type[Endpoint]:
+    """
+    Look name up in the registry, falling back to installed "qloader.endpoints" entry points
+    """
+    if name in ENDPOINTS:
+        return ENDPOINTS[name]
+
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # python < 3.8
+        entry_points = None
+
+    if entry_points is not None:
+        discovered = entry_points()
+        if hasattr(discovered, "select"):
+            candidates = discovered.select(group=ENTRY_POINT_GROUP, name=name)
+        else:
+            candidates = [
+                entry_point
+                for entry_point in discovered.get(ENTRY_POINT_GROUP, [])
+                if entry_point.name == name
+            ]
+        for entry_point in candidates:
+            endpoint_class = entry_point.load()
+            ENDPOINTS[name] = endpoint_class
+            endpoint_class.name = name
+            return endpoint_class
+
+    raise UnimplementedEndpointError(
+        f"No endpoint named '{name}' is registered, known endpoints: {sorted(ENDPOINTS)}"
+    )
+
+
+class WarmResources:
+    """
+    Browsers and HTTP sessions kept open between queries by a long running process (see service.py).
+    Endpoints receive it as the "warm" option and look resources up by a key derived from their options.
+    Not thread safe, use one per worker thread.
+    """
+
+    def __init__(self) -> None:
+        self.resources = dict()
+
+    def get(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        if key not in self.resources:
+            self.resources[key] = factory()
+        return self.resources[key]
+
+    def discard(self, key: Hashable) -> None:
+        resource = self.resources.pop(key, None)
+        if resource is None:
+            return
+        try:
+            if hasattr(resource, "quit"):
+                resource.quit()
+            else:
+                resource.close()
+        except Exception:
+            # a crashed browser may not shut down cleanly, it is being dropped either way
+            pass
+
+    def close(self) -> None:
+        for key in list(self.resources):
+            self.discard(key)
+
+
+class Endpoint:
+    """
+    Base class for endpoints, options are the endpoint specific keyword arguments run() passes through
+    (browser, driver_path, keep_head, use_proxy, browser_profile, warm), unknown options are ignored.
+    """
+
+    name = None
+    # name of an endpoint producing the same results without a browser, used when the query does not need JavaScript
+    browserless_alternative = None
+    # set by get_images, endpoints record every scraped candidate as a "scrape" attempt on it
+    monitor = None
+    # set by get_images, endpoints stop yielding once this threading.Event is set, checking it at least
+    # once per page or pause so that a cancelled query frees its worker quickly
+    cancel = None
+
+    def __init__(self, **options: Any) -> None:
+        self.options = options
+
+    def needs_javascript(self, track_related: bool = False) -> bool:
+        return False
+
+    def image_links(
+        self, queries: List[Dict[str, Any]]
+    ) -> Generator[Tuple[int, Dict[str, Any]], None, None]:
+        """
+        Yield (index into queries, image link). Each query holds "query", "language",
+        "extra_query_params" and "track_related". Closing the generator must release any resources.
+        """
+        raise NotImplementedError
+
+
+@register_endpoint("google-images")
+class GoogleImagesBrowser(Endpoint):
+    """
+    Google images through a selenium webdriver, several queries are driven as tabs of one session
+    """
+
+    browserless_alternative = "google-images-http"
+
+    @property
+    def browser(self) -> str:
+        return self.options.get("browser") or "Firefox"
+
+    def needs_javascript(self, track_related: bool = False) -> bool:
+        # related images only appear after clicking a result, the other options ask for a browser explicitly
+        return (
+            track_related
+            or self.options.get("browser") is not None
+            or self.options.get("keep_head", False)
+            or self.options.get("driver_path") is not None
+            or self.options.get("browser_profile", "default") != "default"
+        )
+
+    def open_driver(self, multiple_tabs: bool = False) -> WebDriver:
+        from . import browserdriver
+        from .query import get_webdriver
+
+        browser_options = browserdriver.get_browser_options(
+            self.browser,
+            self.options.get("keep_head", False),
+            self.options.get("use_proxy"),
+            profile=self.options.get("browser_profile", "default"),
+        )
+        if multiple_tabs and self.browser == "Chrome":
+            # background tabs must keep running while another tab is in front
+            browser_options.add_argument("--disable-background-timer-throttling")
+            browser_options.add_argument("--disable-renderer-backgrounding")
+            browser_options.add_argument("--disable-backgrounding-occluded-windows")
+
+        return get_webdriver(
+            browser=self.browser,
+            browser_options=browser_options,
+            driver_path=self.options.get("driver_path"),
+        )
+
+    def image_links(
+        self, queries: List[Dict[str, Any]]
+    ) -> Generator[Tuple[int, Dict[str, Any]], None, None]:
+        from . import browserdriver
+
+        warm = self.options.get("warm")
+        if warm is not None:
+            key = (
+                "webdriver",
+                self.browser,
+                *[
+                    self.options.get(option)
+                    for option in [
+                        "driver_path",
+                        "keep_head",
+                        "use_proxy",
+                        "browser_profile",
+                    ]
+                ],
+            )
+            # warm browsers may serve multi tab queries later on
+            driver = nullcontext(warm.get(key, lambda: self.open_driver(True)))
+        else:
+            driver = self.open_driver(len(queries) > 1)
+
+        with driver as driver:
+            try:
+                if len(queries) == 1:
+                    for image_link in browserdriver.fetch_google_image_urls(
+                        driver=driver,
+                        sleep_between_interactions=0.2,
+                        monitor=self.monitor,
+                        cancel=self.cancel,
+                        **queries[0],
+                    ):
+                        yield 0, image_link
+                else:
+                    yield from browserdriver.fetch_google_image_urls_in_tabs(
+                        driver=driver,
+                        queries=queries,
+                        sleep_between_interactions=0.2,
+                        monitor=self.monitor,
+                        cancel=self.cancel,
+                    )
+            except Exception:
+                if warm is not None:
+                    # the session may be broken, the next query gets a fresh browser
+                    warm.discard(key)
+                raise
+
+
+@register_endpoint("google-images-http")
+class GoogleImagesHTTP(Endpoint):
+    """
+    Google images over plain HTTP, no browser. Related images are not available.
+    search_url points the backend at another server (e.g. a local stub).
+    """
+
+    def image_links(
+        self, queries: List[Dict[str, Any]]
+    ) -> Generator[Tuple[int, Dict[str, Any]], None, None]:
+        import requests
+
+        from .httpsearch import USER_AGENT, fetch_google_image_urls_http
+
+        log = get_logger("GoogleImagesHTTP")
+        if any(query.get("track_related") for query in queries):
+            log.warning("related images need a browser, they will not be tracked")
+
+        def open_session() -> requests.Session:
+            session = requests.Session()
+            session.headers.update({"User-Agent": USER_AGENT})
+            if self.options.get("use_proxy") is not None:
+                session.proxies.update(
+                    {
+                        "http": self.options["use_proxy"],
+                        "https": self.options["use_proxy"],
+                    }
+                )
+            return session
+
+        warm = self.options.get("warm")
+        if warm is not None:
+            session = nullcontext(
+                warm.get(("session", self.options.get("use_proxy")), open_session)
+            )
+        else:
+            session = open_session()
+
+        with session as session:
+            for tab, query in enumerate(queries):
+                for image_link in fetch_google_image_urls_http(
+                    session=session,
+                    search_url=self.options.get("search_url"),
+                    monitor=self.monitor,
+                    cancel=self.cancel,
+                    **query,
+                ):
+                    yield tab, image_link
@@ -0,0 +1,165 @@
+"""
+Browserless google images search.
+
+The results page google serves to a regular browser embeds every result as a
+[thumbnail url, height, width] entry followed by [original url, height, width] in its inline data,
+so candidate image links can be parsed from the HTML without running any JavaScript.
+Pages without that data (the basic HTML version) fall back to their <img> thumbnails.
+The search requests carry pre-accepted cookie consent, the browser backend clicks through the consent page instead.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from contextlib import nullcontext
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+
+from .logger import get_logger
+
+GOOGLE_SEARCH_URL = os.getenv(
+    "QLOADER_GOOGLE_SEARCH_URL", "https://www.google.com/search"
+)
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:115.0) Gecko/20100101 Firefox/115.0"
+
+# without these, visitors from the EU are redirected to consent.google.com instead of the results
+CONSENT_COOKIES = {"CONSENT": "YES+", "SOCS": "CAI"}
+
+IMAGE_ENTRY_PATTERN = re.compile(r'\["(https?://(?:[^"\\]|\\.)+)",(\d+),(\d+)\]')
+
+
+class NoImageLinksError(Exception):
+    pass
+
+
+def google_search_url(
+    query: str,
+    language: str = "en",
+    extra_query_params: Optional[Dict[str, str]] = None,
+    exact: bool = False,
+    search_url: str = GOOGLE_SEARCH_URL,
+) -> str:
+    """
+    Build the google images search url, shared by the browser and HTTP backends
+    """
+    query_params = {
+        "safe": "off",
+        "tbm": "isch",
+        "q": f"+{query}" if not exact else f'+"{query}"',
+        "lr": f"lang_{language}",
+    }
+
+    if extra_query_params is not None:
+        query_params.update(extra_query_params)
+
+    query_params_str = "&".join([f"{key}={val}" for key, val in query_params.items()])
+
+    return f"{search_url}?{query_params_str}"
+
+
+class ThumbnailParser(HTMLParser):
+    """
+    Collects http(s) <img> sources and their alt text
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.images = list()
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, str]]) -> None:
+        if tag != "img":
+            return
+        attributes = dict(attrs)
+        src = attributes.get("src") or ""
+        if src.startswith("http"):
+            self.images.append({"src": src, "alt": attributes.get("alt") or ""})
+
+
+def is_thumbnail(url: str) -> bool:
+    return "gstatic.com" in url
+
+
+def parse_image_links(html: str) -> List[Dict[str, str]]:
+    """
+    Candidate image links from a results page, originals with their thumbnail as alternate_src when available
+    """
+    image_links = list()
+    thumbnail = None
+    for match in IMAGE_ENTRY_PATTERN.finditer(html):
+        # urls in the inline data are JSON string escaped (=, &, ...)
+        url = json.loads(f'"{match.group(1)}"')
+        if is_thumbnail(url):
+            thumbnail = url
+            continue
+        image_links.append({"src": url, "alt": "", "alternate_src": thumbnail})
+        thumbnail = None
+
+    if len(image_links) == 0:
+        parser = ThumbnailParser()
+        parser.feed(html)
+        image_links = parser.images
+
+    return image_links
+
+
+def fetch_google_image_urls_http(
+    query: str,
+    session: requests.Session,
+    language: str = "en",
+    extra_query_params: Optional[Dict[str, str]] = None,
+    exact: bool = False,
+    sleep_between_pages: float = 0.5,
+    max_pages: int = 10,
+    search_url: Optional[str] = None,
+    monitor: Optional[ErrorRateMonitor] = None,
+    cancel: Optional[threading.Event] = None,
+    **kwargs: Any,
+) -> Generator[Dict[str, str], None, None]:
+    """
+    Yield image links page by page until a page has nothing new, extra keyword arguments
+    (e.g. track_related) that only make sense for the browser backend are ignored.
+    Every page is recorded as a scrape attempt on monitor, a first page without image links fails the scrape.
+    Setting cancel stops before the next page.
+    """
+    log = get_logger("fetch_google_image_urls_http")
+    seen = set()
+    for page in range(max_pages):
+        url = google_search_url(
+            query,
+            language,
+            {**(extra_query_params or dict()), "ijn": page, "start": len(seen)},
+            exact,
+            search_url or GOOGLE_SEARCH_URL,
+        )
+        log.debug("fetching page %d: %s", page, url)
+        with monitor.stage("scrape") if monitor else nullcontext():
+            # sent with the search requests only, image downloads go to other hosts
+            response = session.get(url, timeout=10, cookies=CONSENT_COOKIES)
+            response.raise_for_status()
+            if (urlparse(response.url).hostname or "").startswith("consent."):
+                raise NoImageLinksError(f"redirected to cookie consent: {response.url}")
+            image_links = parse_image_links(response.text)
+            if page == 0 and len(image_links) == 0:
+                # blocked, captcha'd or the page layout changed
+                raise NoImageLinksError(f"no image links in {url}")
+
+        new_links = 0
+        for image_link in image_links:
+            if image_link["src"] in seen:
+                continue
+            seen.add(image_link["src"])
+            new_links += 1
+            yield image_link
+
+        if new_links == 0:
+            break
+        if cancel is None:
+            time.sleep(sleep_between_pages)
+        elif cancel.wait(sleep_between_pages):
+            log.debug("cancelled after %d pages", page + 1)
+            return
+
+    log.debug("found %d image links over http", len(seen))
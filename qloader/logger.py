@@ -1,9 +1,19 @@
 from __future__ import annotations
 
+import atexit
+import contextvars
+import json
 import os
 import logging
+import queue
 import sys
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from uuid import uuid4
 
 FILE_FORMAT = (
     "[%(asctime)s] %(pathname)s:%(lineno)d (%(name)s)  %(levelname)s: %(message)s"
@@ -13,21 +23,201 @@ FILE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
 CONSOLE_FORMAT = "[%(asctime)s] (%(name)s)  %(levelname)s: %(message)s"
 CONSOLE_TIME_FORMAT = "%s"
 
+# large payloads (page sources) are written to side files under this folder, at most MAX_PAYLOAD_FILES per name and query
+PAYLOAD_DIR = Path(
+    os.getenv(
+        "QLOADER_LOG_PAYLOAD_DIR",
+        Path(tempfile.gettempdir()).joinpath("qloader-payloads"),
+    )
+)
+MAX_PAYLOAD_FILES = int(os.getenv("QLOADER_LOG_MAX_PAYLOADS", 10))
+
+RUN_ID = os.getenv("QLOADER_RUN_ID", uuid4().hex)
+
+# per thread (and per task of a ContextThreadPoolExecutor), so concurrent queries each log their own query_id
+_context = contextvars.ContextVar("qloader_log_context", default={"run_id": RUN_ID})
+_listener = None
+_queue_handler = None
+_listener_lock = threading.Lock()
+# payload files written per name, set_log_context(query_id=...) starts a new count that the query's pools share
+# and that goes away with the query
+_payload_counts = contextvars.ContextVar(
+    "qloader_payload_counts", default=defaultdict(int)
+)
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "").lower() in ("1", "true", "yes")
+
+
+def set_log_context(**fields: Any) -> None:
+    """
+    Attach fields (e.g. query_id) to every structured log record of the calling thread from now on,
+    None removes a field
+    """
+    context = dict(_context.get())
+    for key, value in fields.items():
+        if value is None:
+            context.pop(key, None)
+        else:
+            context[key] = value
+    _context.set(context)
+    if "query_id" in fields:
+        _payload_counts.set(defaultdict(int))
+
+
+def get_log_context() -> Dict[str, Any]:
+    return dict(_context.get())
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    Runs each task in a copy of the submitting thread's context, so records logged by the pool's threads
+    carry the log context of the query that submitted them
+    """
+
+    def submit(self, fn: Callable, *args: Any, **kwargs: Any) -> Future:
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Snapshots the log context onto the record in the calling thread
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.context = get_log_context()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, including the run/query ids from set_log_context
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            "time": self.formatTime(record, FILE_TIME_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "location": f"{record.pathname}:{record.lineno}",
+            "message": record.getMessage(),
+        }
+        document.update(getattr(record, "context", _context.get()))
+        if record.exc_info:
+            document["exception"] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Enqueues records untouched, so message formatting happens on the listener thread
+    rather than in the scraping and download threads (the stock QueueHandler formats before enqueueing).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _get_formatter(structured: bool, fmt: str, datefmt: str) -> logging.Formatter:
+    if structured:
+        return JsonFormatter()
+    return logging.Formatter(fmt, datefmt)
+
+
+def _get_queue_handler(
+    console_level: int,
+    log_file: Optional[Path],
+    file_level: int,
+    structured: bool,
+) -> QueueHandler:
+    """
+    Single QueueHandler shared by every qloader logger, drained by a QueueListener thread that owns
+    the console and file handlers
+    """
+    global _listener, _queue_handler
+
+    with _listener_lock:
+        if _queue_handler is not None and _listener is None:
+            # the listener was stopped (at exit), records are still accepted but no longer emitted
+            return _queue_handler
+        elif _queue_handler is not None:
+            has_file = max(
+                [isinstance(h, logging.FileHandler) for h in _listener.handlers]
+            )
+            if log_file is None or has_file:
+                return _queue_handler
+            # a log file was configured after the listener started, restart it with a file handler
+            _listener.stop()
+            handlers = list(_listener.handlers)
+        else:
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setLevel(console_level)
+            console_handler.setFormatter(
+                _get_formatter(structured, CONSOLE_FORMAT, CONSOLE_TIME_FORMAT)
+            )
+            handlers = [console_handler]
+            _queue_handler = LazyQueueHandler(queue.SimpleQueue())
+            _queue_handler.addFilter(ContextFilter())
+
+        if log_file is not None:
+            file_handler = logging.FileHandler(log_file)
+            file_handler.setLevel(file_level)
+            file_handler.setFormatter(
+                _get_formatter(structured, FILE_FORMAT, FILE_TIME_FORMAT)
+            )
+            handlers.append(file_handler)
+
+        _listener = QueueListener(
+            _queue_handler.queue, *handlers, respect_handler_level=True
+        )
+        _listener.start()
+        return _queue_handler
+
+
+@atexit.register
+def stop_listener() -> None:
+    """
+    Flush queued records, registered to run at exit
+    """
+    global _listener
+
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
 
 def get_logger(
     name: str,
     console_level: int = int(os.getenv("QLOADER_LOG_LEVEL", logging.INFO)),
     log_file: Union[str, Path, None] = os.getenv("QLOADER_LOG_FILE", None),
     file_level: int = logging.DEBUG,
+    use_queue: bool = _env_flag("QLOADER_LOG_QUEUE"),
+    structured: bool = os.getenv("QLOADER_LOG_FORMAT", "text") == "json",
 ) -> logging.Logger:
     """
     Wrapper for setting up and getting logger
+
+    use_queue hands records to a background thread for formatting and I/O, structured writes JSON lines.
     """
 
     if not name.startswith("qloader."):
         name = "qloader." + name
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+    # the logger level follows the most verbose handler so that disabled debug calls stay cheap
+    logger.setLevel(min(console_level, file_level) if log_file else console_level)
+
+    if log_file is not None:
+        log_file = Path(log_file)
+
+    if use_queue:
+        queue_handler = _get_queue_handler(
+            console_level, log_file, file_level, structured
+        )
+        if queue_handler not in logger.handlers:
+            logger.addHandler(queue_handler)
+        return logger
 
     if len(logger.handlers) == 0 or not max(
         [isinstance(handler, logging.StreamHandler) for handler in logger.handlers]
@@ -35,17 +225,52 @@ def get_logger(
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setLevel(console_level)
         console_handler.setFormatter(
-            logging.Formatter(CONSOLE_FORMAT, CONSOLE_TIME_FORMAT)
+            _get_formatter(structured, CONSOLE_FORMAT, CONSOLE_TIME_FORMAT)
         )
+        if structured:
+            console_handler.addFilter(ContextFilter())
         logger.addHandler(console_handler)
     if log_file is not None:
-        log_file = Path(log_file)
         if len(logger.handlers) == 0 or not max(
             [isinstance(handler, logging.FileHandler) for handler in logger.handlers]
         ):
             file_handler = logging.FileHandler(log_file)
             file_handler.setLevel(file_level)
-            file_handler.setFormatter(logging.Formatter(FILE_FORMAT, FILE_TIME_FORMAT))
+            file_handler.setFormatter(
+                _get_formatter(structured, FILE_FORMAT, FILE_TIME_FORMAT)
+            )
+            if structured:
+                file_handler.addFilter(ContextFilter())
             logger.addHandler(file_handler)
 
     return logger
+
+
+def log_payload(
+    logger: logging.Logger,
+    name: str,
+    payload: Callable[[], str],
+    level: int = logging.DEBUG,
+) -> Optional[Path]:
+    """
+    Write a large payload (e.g. a page source) to a side file and log its path instead of the payload.
+    payload is only evaluated when level is enabled, and at most MAX_PAYLOAD_FILES are kept per name and query,
+    so a long running service keeps writing them for every new query.
+    """
+    if not logger.isEnabledFor(level):
+        return None
+
+    query_id = _context.get().get("query_id")
+    counts = _payload_counts.get()
+    with _listener_lock:
+        count = counts[name]
+        counts[name] += 1
+    if count >= MAX_PAYLOAD_FILES:
+        return None
+
+    PAYLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    prefix = RUN_ID if query_id is None else f"{RUN_ID}-{query_id}"
+    payload_file = PAYLOAD_DIR.joinpath(f"{prefix}-{name}-{count}.txt")
+    payload_file.write_text(payload())
+    logger.log(level, "wrote %s to %s", name, payload_file)
+    return payload_file
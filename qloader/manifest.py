@@ -0,0 +1,277 @@
+"""
+Manifest schema and sinks.
+
+A manifest lists the documents produced by a query. It can be written as a JSON array (the original format),
+appended to a shared SQLite database, or appended to a Parquet dataset (requires the optional pyarrow dependency).
+The sink is chosen from the manifest path's suffix, see write_manifest.
+"""
+from __future__ import annotations
+
+import json
+import sqlite3
+from collections import UserDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+SQLITE_SUFFIXES = [".sqlite", ".sqlite3", ".db"]
+PARQUET_SUFFIXES = [".parquet"]
+
+
+class ManifestDocument(UserDict):
+    """
+    A single query result. FIELDS lists the typed fields every endpoint may fill in, keys outside of it
+    (the run metadata merged in by run) are kept as they are and stored as a JSON blob by the tabular sinks.
+    """
+
+    FIELDS = {
+        "i": int,
+        "query": str,
+        "endpoint": str,
+        "image_id": str,
+        "image_url": str,
+        "alt": str,
+        "fetch_source": str,
+        "fetch_url": str,
+        "fetch_seconds": float,
+        "hedged": bool,
+        "variant": int,
+    }
+    # headers as returned by parse_url_headers, last_modified is ms since epoch
+    HEADER_FIELDS = {
+        "last_modified": int,
+        "content_type": str,
+        "content_length": int,
+        "server": str,
+    }
+    RELATED_FIELDS = {"image_id": str, "image_url": str, "alt": str}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Plain, JSON serializable copy including the related documents
+        """
+        document = dict(self.data)
+        if "related" in document:
+            document["related"] = [dict(related) for related in document["related"]]
+        return document
+
+    @classmethod
+    def flatten_headers(cls, headers: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        headers = headers or dict()
+        flat = dict()
+        for key, kind in cls.HEADER_FIELDS.items():
+            value = headers.get(key)
+            try:
+                flat[key] = kind(value) if value is not None else None
+            except ValueError:
+                flat[key] = None
+        return flat
+
+    def row(self) -> Dict[str, Any]:
+        """
+        Flat record of the typed fields, headers are inlined and everything else goes into metadata
+        """
+        row = {key: self.data.get(key) for key in self.FIELDS}
+        row.update(self.flatten_headers(self.data.get("headers")))
+        row["metadata"] = json.dumps(
+            {
+                key: value
+                for key, value in self.data.items()
+                if key not in self.FIELDS and key not in ["headers", "related"]
+            },
+            default=str,
+        )
+        return row
+
+    def related_rows(self) -> List[Dict[str, Any]]:
+        rows = list()
+        for related in self.data.get("related", list()):
+            row = {key: related.get(key) for key in self.RELATED_FIELDS}
+            row.update(self.flatten_headers(related.get("headers")))
+            rows.append(row)
+        return rows
+
+
+def write_json_manifest(documents: List[ManifestDocument], path: Path) -> None:
+    path.write_text(
+        json.dumps([document.to_dict() for document in documents], indent=2)
+    )
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    run_id TEXT NOT NULL,
+    query_id TEXT NOT NULL,
+    written_at TEXT NOT NULL,
+    i INTEGER,
+    query TEXT,
+    endpoint TEXT,
+    image_id TEXT,
+    image_url TEXT,
+    alt TEXT,
+    fetch_source TEXT,
+    fetch_url TEXT,
+    fetch_seconds REAL,
+    hedged INTEGER,
+    variant INTEGER,
+    last_modified INTEGER,
+    content_type TEXT,
+    content_length INTEGER,
+    server TEXT,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS related (
+    run_id TEXT NOT NULL,
+    query_id TEXT NOT NULL,
+    parent_image_id TEXT,
+    image_id TEXT,
+    image_url TEXT,
+    alt TEXT,
+    last_modified INTEGER,
+    content_type TEXT,
+    content_length INTEGER,
+    server TEXT
+);
+CREATE INDEX IF NOT EXISTS images_query ON images (query);
+CREATE INDEX IF NOT EXISTS images_image_id ON images (image_id);
+CREATE INDEX IF NOT EXISTS images_content_type ON images (content_type);
+CREATE INDEX IF NOT EXISTS images_last_modified ON images (last_modified);
+CREATE INDEX IF NOT EXISTS images_query_id ON images (query_id);
+CREATE INDEX IF NOT EXISTS related_parent_image_id ON related (parent_image_id);
+CREATE INDEX IF NOT EXISTS related_image_id ON related (image_id);
+"""
+
+
+def write_sqlite_manifest(
+    documents: List[ManifestDocument], path: Path, run_id: str, query_id: str
+) -> None:
+    """
+    Append documents to the SQLite database at path, creating tables and indexes on first use.
+    WAL mode lets concurrent runs append to the same database.
+    """
+    images_columns = (
+        ["run_id", "query_id", "written_at"]
+        + list(ManifestDocument.FIELDS)
+        + list(ManifestDocument.HEADER_FIELDS)
+        + ["metadata"]
+    )
+    related_columns = (
+        ["run_id", "query_id", "parent_image_id"]
+        + list(ManifestDocument.RELATED_FIELDS)
+        + list(ManifestDocument.HEADER_FIELDS)
+    )
+    written_at = datetime.now(timezone.utc).isoformat()
+
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SQLITE_SCHEMA)
+        with connection:
+            connection.executemany(
+                f"INSERT INTO images ({', '.join(images_columns)}) VALUES ({', '.join('?' * len(images_columns))})",
+                [
+                    (run_id, query_id, written_at, *document.row().values())
+                    for document in documents
+                ],
+            )
+            connection.executemany(
+                f"INSERT INTO related ({', '.join(related_columns)}) VALUES ({', '.join('?' * len(related_columns))})",
+                [
+                    (run_id, query_id, document.get("image_id"), *related.values())
+                    for document in documents
+                    for related in document.related_rows()
+                ],
+            )
+    finally:
+        connection.close()
+
+
+def get_parquet_schema() -> "pyarrow.Schema":
+    import pyarrow
+
+    kinds = {
+        int: pyarrow.int64(),
+        str: pyarrow.string(),
+        float: pyarrow.float64(),
+        bool: pyarrow.bool_(),
+    }
+    headers = pyarrow.struct(
+        [(key, kinds[kind]) for key, kind in ManifestDocument.HEADER_FIELDS.items()]
+    )
+    related = pyarrow.struct(
+        [(key, kinds[kind]) for key, kind in ManifestDocument.RELATED_FIELDS.items()]
+        + [("headers", headers)]
+    )
+    return pyarrow.schema(
+        [("run_id", pyarrow.string()), ("query_id", pyarrow.string())]
+        + [(key, kinds[kind]) for key, kind in ManifestDocument.FIELDS.items()]
+        + [
+            ("headers", headers),
+            ("related", pyarrow.list_(related)),
+            ("metadata", pyarrow.string()),
+        ]
+    )
+
+
+def write_parquet_manifest(
+    documents: List[ManifestDocument], path: Path, run_id: str, query_id: str
+) -> Path:
+    """
+    Append documents to the Parquet dataset directory at path as one file per query,
+    readable as a single dataset with pyarrow.dataset.dataset(path)
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as exc:
+        raise ImportError(
+            "writing parquet manifests requires pyarrow, install qloader[parquet]"
+        ) from exc
+
+    records = list()
+    for document in documents:
+        row = document.row()
+        record = {"run_id": run_id, "query_id": query_id}
+        record.update({key: row[key] for key in ManifestDocument.FIELDS})
+        record["headers"] = ManifestDocument.flatten_headers(document.get("headers"))
+        record["related"] = [
+            {
+                **{key: related.get(key) for key in ManifestDocument.RELATED_FIELDS},
+                "headers": ManifestDocument.flatten_headers(related.get("headers")),
+            }
+            for related in document.get("related", list())
+        ]
+        record["metadata"] = row["metadata"]
+        records.append(record)
+
+    path.mkdir(parents=True, exist_ok=True)
+    part_file = path.joinpath(f"{run_id}-{query_id}.parquet")
+    table = pyarrow.Table.from_pylist(records, schema=get_parquet_schema())
+    pyarrow.parquet.write_table(table, part_file)
+    return part_file
+
+
+def write_manifest(
+    documents: List[Union[ManifestDocument, Dict[str, Any]]],
+    path: Union[str, Path],
+    run_id: str,
+    query_id: str,
+) -> None:
+    """
+    Write documents to path, picking the sink from its suffix: .sqlite/.sqlite3/.db append to a SQLite database,
+    .parquet appends to a Parquet dataset directory and anything else is written as a JSON array
+    """
+    path = Path(path)
+    documents = [
+        (
+            document
+            if isinstance(document, ManifestDocument)
+            else ManifestDocument(document)
+        )
+        for document in documents
+    ]
+    if path.suffix in SQLITE_SUFFIXES:
+        write_sqlite_manifest(documents, path, run_id, query_id)
+    elif path.suffix in PARQUET_SUFFIXES:
+        write_parquet_manifest(documents, path, run_id, query_id)
+    else:
+        write_json_manifest(documents, path)
@@ -0,0 +1,137 @@
+"""
+Rolling error rates per ingest stage.
+
+Every scraped thumbnail (scrape), image download (download) and image decode (decode) is recorded as a success or a
+failure. Once a stage has seen min_samples attempts and more than threshold of its last window attempts failed,
+the query is aborted with a diagnostic, so a blocked, captcha'd or broken query frees its worker within seconds
+instead of clicking and downloading until max_items.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+
+STAGES = ["scrape", "download", "decode"]
+
+
+class UnacceptableErrorRateError(Exception):
+    def __init__(self, message: str, stats: Optional[Dict[str, Any]] = None) -> None:
+        super().__init__(message)
+        self.stats = stats
+
+
+class StageWindow:
+    """
+    Outcomes of the last window attempts of one stage, plus totals over the whole query
+    """
+
+    def __init__(self, name: str, window: int) -> None:
+        self.name = name
+        self.outcomes = deque(maxlen=window)
+        self.attempts = 0
+        self.failures = 0
+        self.errors = Counter()
+        self.last_error = None
+
+    def record(self, error: Optional[BaseException] = None) -> None:
+        self.attempts += 1
+        self.outcomes.append(error is not None)
+        if error is not None:
+            self.failures += 1
+            self.errors[type(error).__name__] += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+
+    def rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "attempts": self.attempts,
+            "failures": self.failures,
+            "window_rate": round(self.rate(), 3),
+            "errors": dict(self.errors),
+        }
+
+
+class ErrorRateMonitor:
+    """
+    Thread safe, shared by the scraper and the download threads of one query.
+    threshold=None only counts, it never aborts.
+    """
+
+    def __init__(
+        self,
+        threshold: Optional[float] = float(os.getenv("QLOADER_ABORT_ERROR_RATE", 0.5)),
+        min_samples: int = int(os.getenv("QLOADER_ABORT_MIN_SAMPLES", 20)),
+        window: int = int(os.getenv("QLOADER_ERROR_WINDOW", 50)),
+    ) -> None:
+        if threshold is not None and not 0 <= threshold < 1:
+            raise ValueError(f"threshold must be in [0, 1), got {threshold}")
+        if not 0 < min_samples <= window:
+            raise ValueError(
+                f"min_samples must be in (0, window={window}], got {min_samples}"
+            )
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.stages = {stage: StageWindow(stage, window) for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self.stages[stage].record(error)
+
+    @contextmanager
+    def stage(self, stage: str) -> Generator[None, None, None]:
+        """
+        Record the enclosed block as one attempt of stage, exceptions count as failures and are re-raised
+        """
+        try:
+            yield
+        except Exception as exc:
+            self.record(stage, exc)
+            raise
+        self.record(stage)
+
+    def exceeded(self, stage: str) -> bool:
+        if self.threshold is None:
+            return False
+        with self._lock:
+            window = self.stages[stage]
+            return (
+                len(window.outcomes) >= self.min_samples
+                and window.rate() > self.threshold
+            )
+
+    def diagnostic(self, stage: str) -> str:
+        with self._lock:
+            window = self.stages[stage]
+            common = ", ".join(
+                f"{name} x{count}" for name, count in window.errors.most_common(3)
+            )
+            return (
+                f"{stage} failed {sum(window.outcomes)} of its last {len(window.outcomes)} attempts "
+                f"({window.rate():.0%} > {self.threshold:.0%}), {window.failures}/{window.attempts} overall. "
+                f"Most common errors: {common}. Last error: {window.last_error}"
+            )
+
+    def check(self, stages: Optional[List[str]] = None) -> None:
+        """
+        Raise UnacceptableErrorRateError if any of stages (all by default) is over the threshold
+        """
+        for stage in stages or STAGES:
+            if self.exceeded(stage):
+                raise UnacceptableErrorRateError(
+                    f"aborting early, {self.diagnostic(stage)}", stats=self.stats()
+                )
+
+    def attempts(self, stage: str) -> int:
+        return self.stages[stage].attempts
+
+    def failures(self, stage: str) -> int:
+        return self.stages[stage].failures
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: window.stats() for name, window in self.stages.items()}
@@ -2,8 +2,12 @@
 This program gathers search engine results by running a query against some endpoint.
 Metadata about the queries (host IP geolocation information, query context) are used to tag results.
 
-The first search engine implemented here is google_images. Image files are downloaded by a selenium webdriver.
-Additional endpoints can be implemented by writing a corresponding get_<endpoint> method in this module.
+The first search engine implemented here is google_images, scraped by a selenium webdriver or, when the query
+does not need JavaScript, over plain HTTP. Additional endpoints are implemented as endpoints.Endpoint subclasses
+that yield candidate image links, downloading and manifests are shared by all of them (see get_images).
+
+Heavy dependencies (selenium, requests, PIL, imagehash) are imported where they are first used,
+which keeps `import qloader` and CLI startup cheap.
 """
 from __future__ import annotations
 
@@ -11,27 +15,36 @@ import argparse
 import io
 import os
 import hashlib
+import itertools
 import json
+import threading
 import traceback
 import logging
-from collections import defaultdict, UserDict
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from contextlib import closing, nullcontext
 from datetime import datetime
 from pathlib import Path
 from uuid import uuid4
 
-import imagehash
-import requests
-from PIL import Image, UnidentifiedImageError
-from selenium import webdriver
-from selenium.webdriver.support.ui import WebDriverWait
-
 from .args import get_parser
-from .browserdriver import fetch_google_image_urls, get_browser_options
-from .logger import get_logger
+from .backpressure import PipelineLimits
+from .endpoints import (
+    Endpoint,
+    GoogleImagesBrowser,
+    UnimplementedEndpointError,
+    get_endpoint,
+)
+from .download import LatencyBudget, fetch_content, hedged_fetch
+from .logger import RUN_ID, ContextThreadPoolExecutor, get_logger, set_log_context
+from .manifest import ManifestDocument, write_manifest
+from .monitor import ErrorRateMonitor, UnacceptableErrorRateError
 
 
 def hash_image(image: Image, image_url: str) -> str:
     """ """
+    import imagehash
+
     hash_tuple = (imagehash.colorhash(image), imagehash.average_hash(image))
     name = ""
     for hash_component in hash_tuple:
@@ -44,60 +57,245 @@ def hash_image(image: Image, image_url: str) -> str:
     return hashlib.md5((image_url + name).encode("utf-8")).hexdigest()
 
 
-def persist_image(folder: Path, url: str) -> None:
+def save_image(
+    folder: Path,
+    image_content: bytes,
+    url: str,
+    limits: Optional[PipelineLimits] = None,
+) -> str:
     """
-    Write image to disk
+    Decode downloaded image content and write it to disk, the decoded size counts against limits.decoded_bytes
     """
+    from PIL import Image
+
     folder.mkdir(exist_ok=True, parents=True)
-    image_content = requests.get(url, timeout=5).content
-    image = Image.open(io.BytesIO(image_content)).convert("RGB")
-    image_id = hash_image(image, url)
-    image_file = folder.joinpath(image_id + ".jpg")
-    with open(image_file, "w") as f:
-        image.save(f, "JPEG", optimize=True, quality=85)
+    image = Image.open(io.BytesIO(image_content))
+    # the header is enough to know how large the decoded RGB image will be
+    decoded_size = len(image_content) + image.width * image.height * 3
+    with limits.decoded_bytes.reserve(decoded_size) if limits else nullcontext():
+        image = image.convert("RGB")
+        image_id = hash_image(image, url)
+        image_file = folder.joinpath(image_id + ".jpg")
+        with open(image_file, "w") as f:
+            image.save(f, "JPEG", optimize=True, quality=85)
     return image_id
 
 
-class ManifestDocument(UserDict):
+def persist_image(
+    folder: Path, url: str, limits: Optional[PipelineLimits] = None
+) -> Tuple[str, Optional[Dict[str, Any]]]:
     """
-    This placeholder class is where we could formalize a data structure for the output
+    Write image to disk, returns its image_id and headers
     """
+    with limits.downloads.reserve() if limits else nullcontext():
+        image_content, url_headers = fetch_content(url)
+    image_id = save_image(folder, image_content, url, limits=limits)
+    return image_id, parse_url_headers(url_headers)
 
-    pass
 
+def parse_url_headers(
+    url_headers: Optional[Mapping[str, str]],
+) -> Optional[Dict[str, Any]]:
+    """
+    Pick the headers kept in the manifest out of a response's headers
+    """
+    if url_headers is None:
+        return None
+
+    headers = {
+        header_key.replace("-", "_"): url_headers[header_key]
+        for header_key in [
+            "last-modified",
+            "content-type",
+            "content-length",
+            "server",
+        ]
+        if header_key in url_headers
+    }
+
+    if "last_modified" in headers:
+        # turn last_modified date into ms since epoch
+        headers["last_modified"] = int(
+            datetime.strptime(
+                headers["last_modified"], "%a, %d %b %Y %H:%M:%S %Z"
+            ).timestamp()
+            * 1000
+        )
+    return headers
 
-def get_url_headers(image_url: str) -> Dict[str, Any]:
 
-    try:
-        url_headers = requests.head(image_url, timeout=5).headers
+class RelatedImageIndex:
+    """
+    Downloads related images concurrently and at most once per url, both within a query and
+    across runs sharing the same folder. Completed downloads are appended to index.jsonl in the folder.
+    """
 
-        headers = {
-            header_key.replace("-", "_"): url_headers[header_key]
-            for header_key in [
-                "last-modified",
-                "content-type",
-                "content-length",
-                "server",
-            ]
-            if header_key in url_headers
-        }
+    def __init__(
+        self,
+        folder: Path,
+        executor: Executor,
+        limits: Optional[PipelineLimits] = None,
+    ) -> None:
+        self.folder = folder
+        self.limits = limits
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.index_file = folder.joinpath("index.jsonl")
+        self.executor = executor
+        self.hits = 0
+        self._futures = dict()
+        self._lock = threading.Lock()
+        self._known = dict()
+        if self.index_file.exists():
+            for line in self.index_file.read_text().splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a previous run may have been killed mid-write
+                    continue
+                if folder.joinpath(entry["image_id"] + ".jpg").exists():
+                    self._known[entry["image_url"]] = entry
+
+    def submit(self, url: str) -> Future:
+        """
+        Future resolving to the index entry for url, shared by every caller asking for the same url
+        """
+        with self._lock:
+            if url in self._futures:
+                self.hits += 1
+            elif url in self._known:
+                self.hits += 1
+                self._futures[url] = Future()
+                self._futures[url].set_result(self._known[url])
+            else:
+                self._futures[url] = self.executor.submit(self._persist, url)
+            return self._futures[url]
 
-        if "last_modified" in headers:
-            # turn last_modified date into ms since epoch
-            headers["last_modified"] = int(
-                datetime.strptime(
-                    headers["last_modified"], "%a, %d %b %Y %H:%M:%S %Z"
-                ).timestamp()
-                * 1000
-            )
-    except requests.exceptions.Timeout as exc:
-        headers = None
+    def _persist(self, url: str) -> Dict[str, Any]:
+        image_id, headers = persist_image(self.folder, url, limits=self.limits)
+        entry = {"image_url": url, "image_id": image_id, "headers": headers}
+        with self._lock:
+            with open(self.index_file, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        return entry
 
-    return headers
 
+def process_image(
+    image_link: Dict[str, Any],
+    query: str,
+    store: Path,
+    limits: PipelineLimits,
+    latency_budget: Optional[LatencyBudget],
+    fetch_pool: Executor,
+    related_index: Optional[RelatedImageIndex] = None,
+    monitor: Optional[ErrorRateMonitor] = None,
+) -> Tuple[ManifestDocument, Optional[List[Tuple[Dict, Future]]]]:
+    """
+    Download, decode and store one scraped image, submitting its related images to the related_index.
+    "i" is left for drain_pending to fill in, since images finish out of order.
+    The headers are those of the winning download, the origin is not asked again once the alternate won.
+    The download and decode are recorded as attempts of their stage on monitor.
+    """
+    log = get_logger("process_image")
+
+    with monitor.stage("download") if monitor else nullcontext():
+        # the slot is held until a losing request still downloading on fetch_pool finishes too
+        acquired = limits.downloads.acquire()
+        fetched = hedged_fetch(
+            image_link["src"],
+            alternate_url=image_link.get("alternate_src"),
+            budget=latency_budget,
+            executor=fetch_pool,
+            release=lambda: limits.downloads.release(acquired),
+        )
+        headers = parse_url_headers(fetched.headers)
+    with monitor.stage("decode") if monitor else nullcontext():
+        image_id = save_image(store, fetched.content, fetched.url, limits=limits)
+    log.debug("saved %s from %s", fetched.url, fetched.source)
+    manifest_document = ManifestDocument(
+        {
+            "i": None,
+            "query": query,
+            "image_id": image_id,
+            "image_url": image_link["src"],
+            "headers": headers,
+            "alt": image_link["alt"],
+            "fetch_source": fetched.source,
+            "fetch_url": fetched.url,
+            "fetch_seconds": round(fetched.seconds, 3),
+            "hedged": fetched.hedged,
+        }
+    )
+    if related_index is None:
+        return manifest_document, None
+    return manifest_document, [
+        (related_image, related_index.submit(related_image["src"]))
+        for related_image in image_link.get("related_images", [])
+        if related_image["src"]
+    ]
+
+
+def drain_pending(
+    pending: Deque[Tuple[Future, Optional[int]]],
+    errors: Dict[str, int],
+    counter: Iterator[int],
+    limits: PipelineLimits,
+    keep: int = 0,
+    limit: Optional[int] = None,
+) -> Generator[ManifestDocument, None, None]:
+    """
+    Yield pending images in scrape order once they and their related images are done, numbering them with counter.
+    Blocks on the oldest image while more than keep are pending and stops after yielding limit images.
+    Failed images are counted in errors.
+    """
 
-class UnacceptableErrorRateError(Exception):
-    pass
+    def is_done(future: Future) -> bool:
+        if not future.done():
+            return False
+        if future.exception() is not None or future.result()[1] is None:
+            return True
+        return all(related.done() for _, related in future.result()[1])
+
+    yielded = 0
+    while pending and (limit is None or yielded < limit):
+        future, variant = pending[0]
+        if len(pending) <= keep and not is_done(future):
+            return
+        pending.popleft()
+        limits.queued_urls.release()
+        try:
+            manifest_document, related_futures = future.result()
+        except Exception as e:
+            # collect errors during image gathering for debugging, but accept that some urls will not work.
+            errors[str(type(e))] += 1
+            continue
+
+        manifest_document["i"] = next(counter)
+        if variant is not None:
+            manifest_document["variant"] = variant
+        if related_futures is not None:
+            related_manifests = list()
+            for related_image, future in related_futures:
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    # a broken related image should not cost us the primary image
+                    errors[str(type(e))] += 1
+                    continue
+                related_manifests.append(
+                    ManifestDocument(
+                        {
+                            "i": manifest_document["i"],
+                            "query": manifest_document["query"],
+                            "image_id": entry["image_id"],
+                            "image_url": related_image["src"],
+                            "headers": entry["headers"],
+                            "alt": related_image["alt"],
+                        }
+                    )
+                )
+            manifest_document.update({"related": related_manifests})
+        yielded += 1
+        yield manifest_document
 
 
 def get_webdriver(
@@ -105,6 +303,8 @@ def get_webdriver(
     browser_options: Dict[str, Any],
     driver_path: Optional[str] = None,
 ) -> WebDriver:
+    from selenium import webdriver
+
     log = get_logger(f"get_webdriver.{browser}")
     if driver_path is not None:
         log.debug(f"using {driver_path}")
@@ -122,112 +322,227 @@ def get_webdriver(
     return driver
 
 
-def get_google_images(
+def get_images(
+    endpoint: Endpoint,
     query_terms: str,
     store: Path,
     max_items: int,
-    language: str,
-    browser: str,
     acceptable_error_rate: float,
-    driver_path: Optional[str] = None,
+    language: str = "en",
     extra_query_params: Optional[Dict[str, str]] = None,
     track_related: bool = False,
-    keep_head: bool = False,
-    use_proxy: Optional[str] = None,
+    hedge_percentile: Optional[float] = 0.9,
+    query_variants: Optional[List[Dict[str, Any]]] = None,
+    limits: Optional[PipelineLimits] = None,
+    monitor: Optional[ErrorRateMonitor] = None,
+    cancel: Optional[threading.Event] = None,
 ) -> Generator[ManifestDocument, None, None]:
     """
-    Save images to disk and yield a ManifestDocument for each image
+    Save the images behind an endpoint's image links to disk and yield a ManifestDocument for each image
+
+    Origin downloads slower than the hedge_percentile of recent downloads are raced against
+    an alternate candidate (usually the thumbnail), pass hedge_percentile=None to disable hedging.
+
+    query_variants runs several variants of the query, as tabs of one browser session for the browser endpoint.
+    A variant may override "query_terms", "language" and "extra_query_params" (merged over extra_query_params),
+    e.g. [{"extra_query_params": {"cr": "countryFR"}}, {"extra_query_params": {"cr": "countryCA"}}].
+    Documents from variants carry the index of the variant that found them.
+
+    limits bounds queued urls, in-flight downloads and decoded bytes (see backpressure.PipelineLimits), the
+    scraper is paused while images are being processed faster than they are found. Pass an instance to
+    watch its occupancy while the query runs.
+
+    monitor tracks rolling error rates of the scrape, download and decode stages (see monitor.ErrorRateMonitor)
+    and aborts the query with UnacceptableErrorRateError as soon as one of them is over its threshold.
+    After the query, more than acceptable_error_rate of attempted images failing raises the same error.
+
+    Setting cancel raises QueryCancelledError at the next image link, the endpoint stops scraping at its next
+    page or pause (see Endpoint.cancel) and images that have not started downloading are dropped.
     """
-    log = get_logger("get_google_images")
+    log = get_logger("get_images")
 
     store.mkdir(parents=True, exist_ok=True)
     errors = defaultdict(int)
-    browser_options = get_browser_options(browser, keep_head, use_proxy)
-    with get_webdriver(
-        browser=browser, browser_options=browser_options, driver_path=driver_path
-    ) as driver:
-        wait = WebDriverWait(driver, 10)
+    queries = [
+        {
+            "query": variant.get("query_terms", query_terms),
+            "language": variant.get("language", language),
+            "extra_query_params": {
+                **(extra_query_params or dict()),
+                **variant.get("extra_query_params", dict()),
+            },
+            "track_related": track_related,
+        }
+        for variant in (query_variants or [dict()])
+    ]
+    latency_budget = (
+        LatencyBudget(percentile=hedge_percentile)
+        if hedge_percentile is not None
+        else None
+    )
+    if limits is None:
+        limits = PipelineLimits()
+    if monitor is None:
+        monitor = ErrorRateMonitor()
+    endpoint.monitor = monitor
+    endpoint.cancel = cancel
+
+    def check_cancelled() -> None:
+        if cancel is None or not cancel.is_set():
+            return
+        for future, _ in pending:
+            future.cancel()
+            limits.queued_urls.release()
+        pending.clear()
+        raise QueryCancelledError(f'"{query_terms}" was cancelled after {i} images')
+
+    # scraped images are processed on process_pool and wait here, in scrape order, until they and
+    # their related images are done. Its length is bounded by limits.queued_urls
+    pending = deque()
+    counter = itertools.count(1)
+    process_pool = ContextThreadPoolExecutor(max_workers=limits.downloads.capacity)
+    # hedged requests may use two connections per image
+    fetch_pool = ContextThreadPoolExecutor(max_workers=2 * limits.downloads.capacity)
+    related_pool = ContextThreadPoolExecutor(max_workers=limits.downloads.capacity)
+    with closing(
+        endpoint.image_links(queries)
+    ) as image_links, process_pool, fetch_pool, related_pool:
+        related_index = (
+            RelatedImageIndex(store.joinpath("related"), related_pool, limits=limits)
+            if track_related
+            else None
+        )
         i = 0
-        for image_link in fetch_google_image_urls(
-            query=query_terms,
-            driver=driver,
-            sleep_between_interactions=0.2,
-            language=language,
-            extra_query_params=extra_query_params,
-            track_related=track_related,
-        ):
-
+        for tab, image_link in image_links:
+            check_cancelled()
             log.debug(
-                f"found '{image_link['alt']}'"
-                + (
-                    f" and {len(image_link['related_images'])} related images"
-                    if track_related
-                    else ""
-                )
+                "found '%s' and %d related images",
+                image_link["alt"],
+                len(image_link.get("related_images", [])),
             )
-            try:
-                image_id = persist_image(store, image_link["src"])
-                i += 1
-                log.debug(f"{i}: saved {image_link['src']}")
-                manifest_document = ManifestDocument(
-                    {
-                        "i": i,
-                        "query": query_terms,
-                        "image_id": image_id,
-                        "image_url": image_link["src"],
-                        "headers": get_url_headers(image_link["src"]),
-                        "alt": image_link["alt"],
-                    }
+            # never blocks, draining below keeps fewer than capacity images pending
+            limits.queued_urls.acquire()
+            pending.append(
+                (
+                    process_pool.submit(
+                        process_image,
+                        image_link,
+                        query=queries[tab]["query"],
+                        store=store,
+                        limits=limits,
+                        latency_budget=latency_budget,
+                        fetch_pool=fetch_pool,
+                        related_index=related_index,
+                        monitor=monitor,
+                    ),
+                    tab if query_variants is not None else None,
                 )
-                if track_related:
-                    related_manifests = list()
-                    for related_image in image_link["related_images"]:
-                        related_image_id = persist_image(
-                            store.joinpath("related"), related_image["src"]
-                        )
-                        related_manifests.append(
-                            ManifestDocument(
-                                {
-                                    "i": i,
-                                    "query": query_terms,
-                                    "image_id": related_image_id,
-                                    "image_url": related_image["src"],
-                                    "headers": get_url_headers(related_image["src"]),
-                                    "alt": related_image["alt"],
-                                }
-                            )
-                        )
-
-                    manifest_document.update({"related": related_manifests})
-
-                yield manifest_document
-            except Exception as e:
-                # collect errors during image gathering for debugging, but accept that some urls will not work.
-                # traceback.print_exc()
-                errors[str(type(e))] += 1
+            )
 
+            # while the queue is full, or enough images are in flight to reach max_items, wait on the oldest
+            # image before pulling another link. This is what pauses the scraper's scrolling and clicking.
+            # keep is recomputed as images are yielded, so that images in flight never exceed max_items
+            while i < max_items and len(pending) >= min(
+                limits.queued_urls.capacity, max_items - i
+            ):
+                keep = min(limits.queued_urls.capacity, max_items - i) - 1
+                for manifest_document in drain_pending(
+                    pending, errors, counter, limits, keep=keep, limit=max_items - i
+                ):
+                    i = manifest_document["i"]
+                    yield manifest_document
+
+            monitor.check()
             if i >= max_items:
                 break
 
+        # the endpoint stops early once cancelled
+        check_cancelled()
+        for manifest_document in drain_pending(
+            pending, errors, counter, limits, limit=max_items - i
+        ):
+            i = manifest_document["i"]
+            yield manifest_document
+        if related_index is not None:
+            log.debug(
+                "%d related image downloads were deduplicated", related_index.hits
+            )
+        log.debug("pipeline occupancy: %s", limits.occupancy())
+
     total_errors = sum(errors.values())
-    log.debug(f"retrieved {i} images from google images with {total_errors} errors")
+    log.debug(
+        "retrieved %d images from %s with %d errors", i, endpoint.name, total_errors
+    )
     if total_errors > 0:
-        log.debug(json.dumps(errors, indent=2))
+        log.debug("errors: %s", dict(errors))
+    log.debug("stage error rates: %s", monitor.stats())
 
-    if (len(errors) / max_items) > acceptable_error_rate:
+    # errors also counts related images, the rate is over primary images only
+    attempts = monitor.attempts("download")
+    failures = monitor.failures("download") + monitor.failures("decode")
+    if attempts > 0 and failures / attempts > acceptable_error_rate:
         raise UnacceptableErrorRateError(
-            f"{len(errors)}/{max_items} images failed to download!"
+            f"{failures}/{attempts} images failed to download!", stats=monitor.stats()
         )
 
 
-class UnimplementedEndpointError(Exception):
-    pass
+def get_google_images(
+    query_terms: str,
+    store: Path,
+    max_items: int,
+    language: str,
+    browser: str,
+    acceptable_error_rate: float,
+    driver_path: Optional[str] = None,
+    extra_query_params: Optional[Dict[str, str]] = None,
+    track_related: bool = False,
+    keep_head: bool = False,
+    use_proxy: Optional[str] = None,
+    hedge_percentile: Optional[float] = 0.9,
+    browser_profile: str = "default",
+    query_variants: Optional[List[Dict[str, Any]]] = None,
+    limits: Optional[PipelineLimits] = None,
+    monitor: Optional[ErrorRateMonitor] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Generator[ManifestDocument, None, None]:
+    """
+    Save images to disk and yield a ManifestDocument for each image, scraped with a selenium webdriver.
+    See get_images for the remaining arguments.
+
+    browser_profile selects one of browserdriver.BROWSER_PROFILES, "lean" cuts browser CPU and bandwidth.
+    query_variants are driven as tabs of one browser session, interleaving their interactions.
+    """
+    yield from get_images(
+        GoogleImagesBrowser(
+            browser=browser,
+            driver_path=driver_path,
+            keep_head=keep_head,
+            use_proxy=use_proxy,
+            browser_profile=browser_profile,
+        ),
+        query_terms=query_terms,
+        store=store,
+        max_items=max_items,
+        acceptable_error_rate=acceptable_error_rate,
+        language=language,
+        extra_query_params=extra_query_params,
+        track_related=track_related,
+        hedge_percentile=hedge_percentile,
+        query_variants=query_variants,
+        limits=limits,
+        monitor=monitor,
+        cancel=cancel,
+    )
 
 
 class NoDocumentsReturnedError(Exception):
     pass
 
 
+class QueryCancelledError(Exception):
+    pass
+
+
 def run(
     endpoint: str,
     query_terms: str,
@@ -235,18 +550,42 @@ def run(
     max_items: int,
     metadata: Optional[Union[Path, str, Dict[str, Any]]] = None,
     language: str = "en",
-    browser: str = "Firefox",
+    browser: Optional[str] = None,
     driver_path: Optional[str] = None,
-    manifest_file: Optional[Union[str, Path]] = None,
+    manifest_file: Optional[Union[str, Path, List[Union[str, Path]]]] = None,
     acceptable_error_rate: float = 0.20,
     extra_query_params: Optional[Dict[str, str]] = None,
     track_related: bool = False,
     keep_head: bool = False,
     use_proxy: Optional[str] = None,
+    hedge_percentile: Optional[float] = 0.9,
+    browser_profile: str = "default",
+    query_variants: Optional[List[Dict[str, Any]]] = None,
+    limits: Optional[PipelineLimits] = None,
+    browserless: Optional[bool] = None,
+    endpoint_options: Optional[Dict[str, Any]] = None,
+    on_document: Optional[Callable[[Dict[str, Any]], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    monitor: Optional[ErrorRateMonitor] = None,
 ) -> List[Dict[str, Any]]:
     """
     Executes a query and returns a list of objects returned by that query, may also leave data on disk at {output_path}
     depending on the endpoint and type of data.
+
+    endpoint is looked up in the endpoint registry (see endpoints.py). When the endpoint has a browserless
+    alternative it is used whenever the query does not need JavaScript, browserless=False always uses the
+    browser and browserless=True always uses the alternative. Passing a browser (Firefox when not set) counts
+    as needing one.
+
+    manifest_file may be one path or a list of paths, the sink is picked by suffix (see manifest.write_manifest):
+    .sqlite/.sqlite3/.db and .parquet append to a shared dataset, anything else is written as a JSON array.
+
+    endpoint_options are passed to the endpoint on top of the browser options (e.g. warm resources, see service.py).
+    on_document is called with each document as soon as it is saved. Setting cancel stops the query at the next
+    document, image link or scraper pause and raises QueryCancelledError, no manifest is written.
+
+    monitor aborts the query early when a stage keeps failing (see get_images). Once the query is done, its
+    per stage attempts and failures are added to every document as "error_counts".
     """
     output_path.mkdir(parents=True, exist_ok=True)
 
@@ -261,41 +600,72 @@ def run(
         metadata = dict()
 
     metadata.update({"endpoint": endpoint})
+    query_id = uuid4().hex
+    set_log_context(query_id=query_id, endpoint=endpoint, query=query_terms)
+
+    endpoint_options = {
+        "browser": browser,
+        "driver_path": driver_path,
+        "keep_head": keep_head,
+        "use_proxy": use_proxy,
+        "browser_profile": browser_profile,
+        **(endpoint_options or dict()),
+    }
+    backend = get_endpoint(endpoint)(**endpoint_options)
+    if backend.browserless_alternative is not None and (
+        browserless
+        or (browserless is None and not backend.needs_javascript(track_related))
+    ):
+        backend = get_endpoint(backend.browserless_alternative)(**endpoint_options)
+    metadata.update({"backend": backend.name})
+    log.debug("running %s with %s", endpoint, backend.name)
+
+    if monitor is None:
+        monitor = ErrorRateMonitor()
 
     documents = []
-    if endpoint == "google-images":
-        for i, doc in enumerate(
-            get_google_images(
-                query_terms=query_terms,
-                store=output_path,
-                max_items=max_items,
-                language=language,
-                browser=browser,
-                acceptable_error_rate=acceptable_error_rate,
-                driver_path=driver_path,
-                extra_query_params=extra_query_params,
-                track_related=track_related,
-                keep_head=keep_head,
-                use_proxy=use_proxy,
-            )
-        ):
-            doc.update(metadata)
-            documents.append(doc.data)
-    else:
-        raise UnimplementedEndpointError(
-            f"No get_{endpoint} method could be found in {__file__}"
+    for doc in get_images(
+        backend,
+        query_terms=query_terms,
+        store=output_path,
+        max_items=max_items,
+        acceptable_error_rate=acceptable_error_rate,
+        language=language,
+        extra_query_params=extra_query_params,
+        track_related=track_related,
+        hedge_percentile=hedge_percentile,
+        query_variants=query_variants,
+        limits=limits,
+        monitor=monitor,
+        cancel=cancel,
+    ):
+        doc.update(metadata)
+        documents.append(doc.to_dict())
+        if on_document is not None:
+            on_document(documents[-1])
+        if cancel is not None and cancel.is_set():
+            break
+
+    if cancel is not None and cancel.is_set():
+        raise QueryCancelledError(
+            f'"{query_terms}" was cancelled after {len(documents)} documents'
         )
 
     if len(documents) == 0:
         raise NoDocumentsReturnedError(f"{endpoint} yielded no documents")
 
+    error_counts = {
+        stage: {"attempts": stats["attempts"], "failures": stats["failures"]}
+        for stage, stats in monitor.stats().items()
+    }
+    for doc in documents:
+        doc["error_counts"] = error_counts
+
     if manifest_file is not None:
-        Path(manifest_file).write_text(
-            json.dumps(
-                [dict(d) for d in documents],
-                indent=2,
-            )
-        )
+        if not isinstance(manifest_file, list):
+            manifest_file = [manifest_file]
+        for manifest_path in manifest_file:
+            write_manifest(documents, manifest_path, run_id=RUN_ID, query_id=query_id)
 
     log.debug(
         f'"{query_terms}" completed query against {endpoint}, images gathered here: {output_path}.'
@@ -0,0 +1,740 @@
+"""
+Long running query service.
+
+Jobs are rows of a SQLite database (the job queue). They are submitted through a small local HTTP API, or inserted
+by any other process sharing the database, and claimed by a fixed number of worker threads. Each worker keeps its
+browser and HTTP session warm between jobs, so only its first job pays for starting a browser. Documents are appended
+to {jobs_dir}/{job_id}/results.jsonl as soon as they are saved and can be streamed while the job runs.
+
+    POST   /jobs                  {"query_terms": "cute dog", "max_items": 50}, any run() parameter in JOB_PARAMETERS
+    GET    /jobs                  status of every job
+    GET    /jobs/{id}             status of one job
+    GET    /jobs/{id}/results     documents as JSON lines, streamed until the job finishes
+    GET    /jobs/{id}/manifest    the job's JSON manifest once it is done
+    DELETE /jobs/{id}             cancel a queued or running job
+    GET    /health
+
+On SIGTERM (or SIGINT) the service stops accepting jobs and lets running jobs finish. Jobs still running after
+drain_timeout are cancelled and put back in the queue, queued jobs stay in the database for the next start.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from uuid import uuid4
+
+from .args import env_default, path_or_tempdir
+from .endpoints import WarmResources
+from .logger import get_logger
+from .monitor import ErrorRateMonitor
+from .query import QueryCancelledError, run
+
+JOB_STATES = ["queued", "running", "done", "failed", "cancelled"]
+FINISHED_STATES = ["done", "failed", "cancelled"]
+
+# run() parameters a job may set, output_path and manifest_file are managed by the service.
+# driver_path and keep_head pick a binary to run and a display on the host, they are options of the Service
+JOB_PARAMETERS = [
+    "endpoint",
+    "query_terms",
+    "max_items",
+    "metadata",
+    "language",
+    "browser",
+    "acceptable_error_rate",
+    "extra_query_params",
+    "track_related",
+    "use_proxy",
+    "hedge_percentile",
+    "browser_profile",
+    "query_variants",
+    "browserless",
+]
+JOB_DEFAULTS = {"endpoint": "google-images", "max_items": 100}
+
+# running jobs whose service has not renewed their lease for this many seconds are claimed again,
+# the service that crashed or was killed while running them will not finish them
+LEASE_TIMEOUT = float(os.getenv("QLOADER_JOB_LEASE", 60))
+
+# how long stop() waits on cancelled jobs before giving up on their worker threads
+CANCEL_TIMEOUT = float(os.getenv("QLOADER_CANCEL_TIMEOUT", 10))
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    documents INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    error_counts TEXT,
+    submitted_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    worker TEXT,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, submitted_at);
+"""
+
+
+class InvalidJobError(ValueError):
+    pass
+
+
+class ServiceDrainingError(Exception):
+    pass
+
+
+def check_job(params: Dict[str, Any]) -> None:
+    """
+    Raise InvalidJobError for job parameters run() can not start with.
+    metadata must be inline, a path would have the service read files on the client's behalf
+    """
+    if not params.get("query_terms"):
+        raise InvalidJobError("query_terms is required")
+    if not isinstance(params.get("metadata") or dict(), dict):
+        raise InvalidJobError("metadata must be a JSON object")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class JobQueue:
+    """
+    SQLite backed job queue, several processes may share the same database.
+    Claimed jobs are leased to a worker, which renews the lease with heartbeat() while they run.
+    """
+
+    def __init__(
+        self, path: Union[str, Path], lease_timeout: float = LEASE_TIMEOUT
+    ) -> None:
+        self.path = Path(path)
+        self.lease_timeout = lease_timeout
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(JOBS_SCHEMA)
+            # queues created before jobs were leased
+            columns = [
+                row["name"] for row in connection.execute("PRAGMA table_info(jobs)")
+            ]
+            for column, column_type in [("worker", "TEXT"), ("heartbeat_at", "REAL")]:
+                if column not in columns:
+                    connection.execute(
+                        f"ALTER TABLE jobs ADD COLUMN {column} {column_type}"
+                    )
+
+    @contextmanager
+    def _connect(self) -> Generator[sqlite3.Connection, None, None]:
+        # autocommit, transactions are opened explicitly where needed
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        job["error_counts"] = json.loads(job["error_counts"] or "null")
+        return job
+
+    def submit(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        unknown = sorted(set(params) - set(JOB_PARAMETERS))
+        if len(unknown) > 0:
+            raise InvalidJobError(f"unknown job parameters: {unknown}")
+        check_job(params)
+
+        job_id = uuid4().hex
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, params, status, submitted_at) VALUES (?, ?, 'queued', ?)",
+                (job_id, json.dumps({**JOB_DEFAULTS, **params}), _now()),
+            )
+        return self.get(job_id)
+
+    def claim(self, worker: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Mark the oldest queued job as running, leased to worker, and return it. None when the queue is empty.
+        Running jobs whose lease expired are queued again first.
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "UPDATE jobs SET status = 'queued', started_at = NULL, worker = NULL, heartbeat_at = NULL "
+                    "WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                    (time.time() - self.lease_timeout,),
+                )
+                row = connection.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY submitted_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, documents = 0, worker = ?, "
+                        "heartbeat_at = ? WHERE id = ?",
+                        (_now(), worker, time.time(), row["id"]),
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return self.get(row["id"]) if row is not None else None
+
+    def heartbeat(self, job_ids: List[str]) -> None:
+        """
+        Renew the lease of running jobs
+        """
+        with self._connect() as connection:
+            connection.executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                [(time.time(), job_id) for job_id in job_ids],
+            )
+
+    def progress(self, job_id: str, documents: int) -> bool:
+        """
+        Record the number of documents found so far, returns whether the job was asked to cancel
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET documents = ?, heartbeat_at = ? WHERE id = ?",
+                (documents, time.time(), job_id),
+            )
+            row = connection.execute(
+                "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return bool(row["cancel_requested"])
+
+    def finish(
+        self,
+        job_id: str,
+        status: str,
+        error: Optional[str] = None,
+        error_counts: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, error_counts = ?, finished_at = ? WHERE id = ?",
+                (status, error, json.dumps(error_counts), _now(), job_id),
+            )
+
+    def requeue(self, job_id: str) -> None:
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, worker = NULL, heartbeat_at = NULL "
+                "WHERE id = ?",
+                (job_id,),
+            )
+
+    def request_cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Queued jobs are cancelled right away, running jobs stop after their current document
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, finished_at = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (_now(), job_id),
+            )
+            connection.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'",
+                (job_id,),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as connection:
+            return self._to_dict(
+                connection.execute(
+                    "SELECT * FROM jobs WHERE id = ?", (job_id,)
+                ).fetchone()
+            )
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._connect() as connection:
+            return [
+                self._to_dict(row)
+                for row in connection.execute(
+                    "SELECT * FROM jobs ORDER BY submitted_at"
+                ).fetchall()
+            ]
+
+
+class Service:
+    """
+    Runs jobs from a JobQueue on a fixed number of worker threads, each with its own warm resources.
+    manifest_files are shared sinks (e.g. a .sqlite or .parquet dataset) every job is written to,
+    on top of its own {jobs_dir}/{job_id}/manifest.json.
+    """
+
+    def __init__(
+        self,
+        jobs_dir: Path,
+        workers: int = 1,
+        manifest_files: Optional[List[Union[str, Path]]] = None,
+        queue: Optional[JobQueue] = None,
+        poll_interval: float = 1.0,
+        driver_path: Optional[str] = None,
+        keep_head: bool = False,
+    ) -> None:
+        if workers < 1:
+            raise ValueError(f"workers must be at least 1, got {workers}")
+        self.jobs_dir = Path(jobs_dir)
+        self.workers = workers
+        self.manifest_files = list(manifest_files or [])
+        self.queue = queue or JobQueue(self.jobs_dir.joinpath("jobs.sqlite"))
+        self.poll_interval = poll_interval
+        self.driver_path = driver_path
+        self.keep_head = keep_head
+        self.stopping = threading.Event()
+        # job id -> cancel event of the jobs running in this process
+        self.running = dict()
+        # leases of running jobs are held by this id
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._threads = list()
+        self._stopped = threading.Event()
+        self.log = get_logger("service")
+
+    def job_dir(self, job_id: str) -> Path:
+        return self.jobs_dir.joinpath(job_id)
+
+    def results_file(self, job_id: str) -> Path:
+        return self.job_dir(job_id).joinpath("results.jsonl")
+
+    def manifest_file(self, job_id: str) -> Path:
+        return self.job_dir(job_id).joinpath("manifest.json")
+
+    def submit(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if self.stopping.is_set():
+            raise ServiceDrainingError("the service is draining, not accepting jobs")
+        return self.queue.submit(params)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.queue.request_cancel(job_id)
+        with self._lock:
+            cancel = self.running.get(job_id)
+        if cancel is not None:
+            cancel.set()
+        return job
+
+    def start(self) -> None:
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"qloader-worker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        threading.Thread(
+            target=self._heartbeat, name="qloader-heartbeat", daemon=True
+        ).start()
+        self.log.info("started %d workers on %s", self.workers, self.queue.path)
+
+    def _heartbeat(self) -> None:
+        """
+        Renew the leases of this service's running jobs until stop() returns
+        """
+        while not self._stopped.wait(self.queue.lease_timeout / 4):
+            with self._lock:
+                job_ids = list(self.running)
+            try:
+                self.queue.heartbeat(job_ids)
+            except sqlite3.Error as exc:
+                # a busy database, the lease outlives a few missed beats
+                self.log.warning("could not renew job leases: %s", exc)
+
+    def _work(self) -> None:
+        warm = WarmResources()
+        try:
+            while not self.stopping.is_set():
+                job = self.queue.claim(
+                    f"{self.worker_id}:{threading.current_thread().name}"
+                )
+                if job is None:
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                self.run_job(job, warm)
+        finally:
+            warm.close()
+
+    def run_job(
+        self, job: Dict[str, Any], warm: Optional[WarmResources] = None
+    ) -> None:
+        job_id = job["id"]
+        cancel = threading.Event()
+        monitor = ErrorRateMonitor()
+        with self._lock:
+            self.running[job_id] = cancel
+        documents = 0
+
+        # a malformed job fails, it must not take the worker down with it
+        try:
+            # rows inserted straight into the database are not validated by submit()
+            params = {
+                key: value
+                for key, value in job["params"].items()
+                if key in JOB_PARAMETERS
+            }
+            check_job(params)
+            params["metadata"] = {
+                **(params.get("metadata") or dict()),
+                "job_id": job_id,
+            }
+            self.log.info("running job %s: %s", job_id, params["query_terms"])
+
+            self.job_dir(job_id).mkdir(parents=True, exist_ok=True)
+            # a requeued job starts over
+            with self.results_file(job_id).open("w") as results:
+
+                def on_document(document: Dict[str, Any]) -> None:
+                    nonlocal documents
+                    results.write(json.dumps(document, default=str) + "\n")
+                    results.flush()
+                    documents += 1
+                    if self.queue.progress(job_id, documents):
+                        cancel.set()
+
+                run(
+                    output_path=self.job_dir(job_id),
+                    manifest_file=[self.manifest_file(job_id), *self.manifest_files],
+                    endpoint_options={"warm": warm} if warm is not None else None,
+                    on_document=on_document,
+                    cancel=cancel,
+                    monitor=monitor,
+                    driver_path=self.driver_path,
+                    keep_head=self.keep_head,
+                    **params,
+                )
+        except QueryCancelledError:
+            if self.queue.get(job_id)["cancel_requested"]:
+                self.queue.finish(job_id, "cancelled", error_counts=monitor.stats())
+            else:
+                # interrupted by a drain timeout, another start picks it up again
+                self.log.warning("job %s was interrupted, requeueing it", job_id)
+                self.queue.requeue(job_id)
+        except Exception as exc:
+            self.log.exception("job %s failed", job_id)
+            self.queue.finish(
+                job_id,
+                "failed",
+                error=f"{type(exc).__name__}: {exc}",
+                error_counts=monitor.stats(),
+            )
+        else:
+            self.queue.finish(job_id, "done", error_counts=monitor.stats())
+        finally:
+            with self._lock:
+                self.running.pop(job_id, None)
+        self.log.info("job %s finished with %d documents", job_id, documents)
+
+    def stop(
+        self,
+        drain_timeout: Optional[float] = None,
+        cancel_timeout: float = CANCEL_TIMEOUT,
+    ) -> None:
+        """
+        Stop claiming jobs and wait for running jobs to finish, after drain_timeout seconds they are cancelled
+        and requeued. Waits indefinitely when drain_timeout is None. Workers that do not stop within cancel_timeout
+        of being cancelled (e.g. an endpoint stuck before its first page) are left behind, their jobs are requeued.
+        """
+        self.stopping.set()
+        self.log.info("draining %d running jobs", len(self.running))
+        deadline = time.time() + drain_timeout if drain_timeout is not None else None
+        for thread in self._threads:
+            thread.join(
+                max(0, deadline - time.time()) if deadline is not None else None
+            )
+        if any(thread.is_alive() for thread in self._threads):
+            with self._lock:
+                interrupted = list(self.running.values())
+            self.log.warning(
+                "interrupting %d jobs after the drain timeout", len(interrupted)
+            )
+            for cancel in interrupted:
+                cancel.set()
+            deadline = time.time() + cancel_timeout
+            for thread in self._threads:
+                thread.join(max(0, deadline - time.time()))
+        with self._lock:
+            stuck = list(self.running)
+        for job_id in stuck:
+            self.log.warning(
+                "job %s did not stop within %ss, requeueing it", job_id, cancel_timeout
+            )
+            self.queue.requeue(job_id)
+        self._stopped.set()
+        self._threads = list()
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of a Service, see the module docstring
+    """
+
+    stream_poll_interval = 0.2
+
+    @property
+    def service(self) -> Service:
+        return self.server.service
+
+    def send_json(self, status: int, document: Any) -> None:
+        body = json.dumps(document, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self) -> Tuple[Optional[str], Optional[str]]:
+        """
+        /jobs/{id}/{action} -> (id, action)
+        """
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        job_id = parts[1] if len(parts) > 1 else None
+        action = parts[2] if len(parts) > 2 else None
+        return job_id, action
+
+    def do_POST(self) -> None:
+        if self.route() != (None, None) or not self.path.startswith("/jobs"):
+            return self.send_json(404, {"error": f"no such resource {self.path}"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            params = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(params, dict):
+                raise InvalidJobError("a job is a JSON object of run parameters")
+            job = self.service.submit(params)
+        except (InvalidJobError, json.JSONDecodeError) as exc:
+            return self.send_json(400, {"error": str(exc)})
+        except ServiceDrainingError as exc:
+            return self.send_json(503, {"error": str(exc)})
+        self.send_json(201, job)
+
+    def do_DELETE(self) -> None:
+        job_id, _ = self.route()
+        job = self.service.cancel(job_id) if job_id is not None else None
+        if job is None:
+            return self.send_json(404, {"error": f"no such job {job_id}"})
+        self.send_json(202, job)
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/health"):
+            return self.send_json(
+                200,
+                {
+                    "status": "draining" if self.service.stopping.is_set() else "ok",
+                    "workers": self.service.workers,
+                    "running": list(self.service.running),
+                },
+            )
+        if not self.path.startswith("/jobs"):
+            return self.send_json(404, {"error": f"no such resource {self.path}"})
+
+        job_id, action = self.route()
+        if job_id is None:
+            return self.send_json(200, self.service.queue.list())
+        job = self.service.queue.get(job_id)
+        if job is None:
+            return self.send_json(404, {"error": f"no such job {job_id}"})
+        if action is None:
+            return self.send_json(200, job)
+        if action == "results":
+            return self.stream_results(job_id)
+        if action == "manifest":
+            manifest = self.service.manifest_file(job_id)
+            if job["status"] != "done" or not manifest.exists():
+                return self.send_json(409, {"error": "job is not done", **job})
+            return self.send_json(200, json.loads(manifest.read_text()))
+        self.send_json(404, {"error": f"no such resource {self.path}"})
+
+    def stream_results(self, job_id: str) -> None:
+        """
+        Send result lines as they are written, the response ends once the job is finished
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+
+        results_file = self.service.results_file(job_id)
+        position = 0
+        try:
+            while True:
+                # read the status first so lines written just before the job finished are not missed
+                finished = self.service.queue.get(job_id)["status"] in FINISHED_STATES
+                if results_file.exists():
+                    with results_file.open("rb") as results:
+                        results.seek(position)
+                        chunk = results.read()
+                    # only send complete lines
+                    chunk = chunk[: chunk.rfind(b"\n") + 1]
+                    if len(chunk) > 0:
+                        self.wfile.write(chunk)
+                        self.wfile.flush()
+                        position += len(chunk)
+                        continue
+                if finished:
+                    return
+                time.sleep(self.stream_poll_interval)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    def log_message(self, format: str, *args: Any) -> None:
+        get_logger("service.http").debug(format, *args)
+
+
+def make_server(
+    service: Service, host: str = "127.0.0.1", port: int = 8008
+) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def serve(
+    service: Service,
+    host: str = "127.0.0.1",
+    port: int = 8008,
+    drain_timeout: Optional[float] = None,
+    http: bool = True,
+) -> None:
+    """
+    Run the service until SIGTERM or SIGINT, then drain it. Without http, jobs only come from the queue database.
+    """
+    log = get_logger("serve")
+    server = make_server(service, host, port) if http else None
+    stopped = threading.Event()
+
+    def drain() -> None:
+        service.stop(drain_timeout)
+        if server is not None:
+            server.shutdown()
+        stopped.set()
+
+    def handle_signal(signum: int, frame: Any) -> None:
+        if not service.stopping.is_set():
+            log.info("received signal %d, draining", signum)
+            # serve_forever runs in this thread, shutting the server down from here would deadlock
+            threading.Thread(target=drain, name="qloader-drain").start()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    service.start()
+    if server is not None:
+        log.info("listening on http://%s:%d", *server.server_address[:2])
+        server.serve_forever()
+        server.server_close()
+    stopped.wait()
+    log.info("drained")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--host",
+        type=str,
+        action=env_default("QLOADER_SERVICE_HOST"),
+        default="127.0.0.1",
+        help="Address the HTTP API listens on",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        action=env_default("QLOADER_SERVICE_PORT"),
+        default=8008,
+        help="Port the HTTP API listens on",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        action=env_default("QLOADER_SERVICE_WORKERS"),
+        default=1,
+        help="Number of jobs run concurrently, each worker keeps its own browser warm",
+    )
+    parser.add_argument(
+        "--jobs-dir",
+        type=path_or_tempdir,
+        action=env_default("QLOADER_JOBS_DIR"),
+        required=False,
+        default="",
+        help="Where job results and the jobs.sqlite queue are stored, defaults to a new temporary directory",
+    )
+    parser.add_argument(
+        "--queue",
+        type=Path,
+        action=env_default("QLOADER_JOB_QUEUE"),
+        required=False,
+        help="Job queue database shared with other processes, defaults to jobs.sqlite in the jobs dir",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        action="append",
+        help="Shared manifest every job is appended to (.sqlite/.db or .parquet), may be repeated",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        action=env_default("QLOADER_DRAIN_TIMEOUT"),
+        default=300.0,
+        help="Seconds running jobs get to finish on SIGTERM before they are requeued",
+    )
+    parser.add_argument(
+        "--driver-path",
+        type=str,
+        action=env_default("QLOADER_DRIVER_PATH"),
+        required=False,
+        help="WebDriver binary used by every job, defaults to the one found in PATH",
+    )
+    parser.add_argument(
+        "--keep-head",
+        action="store_true",
+        help="Run the browsers of every job with a visible window",
+    )
+    parser.add_argument(
+        "--no-http",
+        action="store_true",
+        help="Only run jobs inserted in the queue database, without the HTTP API",
+    )
+
+    return parser
+
+
+def main(args: argparse.Namespace) -> None:
+    service = Service(
+        jobs_dir=args.jobs_dir,
+        workers=args.workers,
+        manifest_files=args.manifest,
+        queue=JobQueue(args.queue) if args.queue is not None else None,
+        driver_path=args.driver_path,
+        keep_head=args.keep_head,
+    )
+    serve(
+        service,
+        host=args.host,
+        port=args.port,
+        drain_timeout=args.drain_timeout,
+        http=not args.no_http,
+    )
+
+
+if __name__ == "__main__":
+    main(get_parser().parse_args())
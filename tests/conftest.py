@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the unit tests: stub HTTP servers, small PNG images and test endpoints.
+Test modules import the helpers with `from conftest import ...`, the fixtures are picked up by pytest.
+"""
+import base64
+import io
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from qloader.endpoints import ENDPOINTS, register_endpoint
+
+
+def png_bytes(color, size=(8, 8)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def data_uri(index: int) -> str:
+    """
+    Inline PNG, a different color per index
+    """
+    color = (index % 256, index // 256 % 256, 0)
+    return f"data:image/png;base64,{base64.b64encode(png_bytes(color)).decode()}"
+
+
+@pytest.fixture(scope="module")
+def serve_http():
+    """
+    Start a ThreadingHTTPServer for a handler class on a free local port and return its base url,
+    the servers are shut down with the test module
+    """
+    servers = list()
+
+    def start(handler_class) -> str:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def register_test_endpoints():
+    """
+    Register {name: endpoint class} for one test, the endpoints are removed from the registry afterwards
+    """
+    registered = list()
+
+    def register(endpoints) -> None:
+        for name, endpoint_class in endpoints.items():
+            register_endpoint(name)(endpoint_class)
+            registered.append(name)
+
+    yield register
+    for name in registered:
+        ENDPOINTS.pop(name, None)
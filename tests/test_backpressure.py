@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+import pytest
+
+from qloader import browserdriver, query
+from qloader.backpressure import BoundedStage, PipelineLimits
+from qloader.manifest import ManifestDocument
+
+
+@pytest.mark.unit
+def test_bounded_stage_blocks_until_released() -> None:
+    stage = BoundedStage("downloads", 2)
+    stage.acquire()
+    stage.acquire()
+    assert stage.saturated
+
+    threading.Timer(0.2, stage.release).start()
+    start = time.time()
+    stage.acquire()
+    assert time.time() - start >= 0.15
+    assert stage.peak == 2
+
+    # an oversized reservation waits for the stage to drain rather than deadlocking
+    stage.release(2)
+    with stage.reserve(100):
+        assert stage.occupancy == 2
+
+
+@pytest.mark.unit
+def test_scraper_is_paused_while_downstream_is_saturated(monkeypatch) -> None:
+    pulled = list()
+    unblock = threading.Event()
+
+    def fake_fetch_google_image_urls(**kwargs):
+        for n in range(100):
+            pulled.append(n)
+            yield {"src": f"http://example.com/{n}.jpg", "alt": str(n)}
+
+    def fake_process_image(image_link, query, **kwargs):
+        unblock.wait()
+        if image_link["alt"] == "3":
+            raise ValueError("broken image")
+        return query_document(image_link, query), None
+
+    def query_document(image_link, query_terms):
+        return query.ManifestDocument(
+            {"i": None, "query": query_terms, "image_url": image_link["src"]}
+        )
+
+    monkeypatch.setattr(query, "get_webdriver", lambda **kwargs: nullcontext(None))
+    monkeypatch.setattr(
+        browserdriver, "fetch_google_image_urls", fake_fetch_google_image_urls
+    )
+    monkeypatch.setattr(query, "process_image", fake_process_image)
+
+    limits = PipelineLimits(max_queued_urls=4, max_inflight_downloads=2)
+    documents = query.get_google_images(
+        query_terms="dog",
+        store=Path(tempfile.mkdtemp()),
+        max_items=10,
+        language="en",
+        browser="Firefox",
+        acceptable_error_rate=1.0,
+        limits=limits,
+    )
+
+    threading.Timer(0.3, unblock.set).start()
+    first = next(documents)
+    # nothing was processed for 0.3s, so the scraper must have stopped at the queue limit
+    assert len(pulled) == limits.queued_urls.capacity
+    results = [first] + list(documents)
+
+    assert [document["i"] for document in results] == list(range(1, 11))
+    assert "http://example.com/3.jpg" not in [d["image_url"] for d in results]
+    assert limits.queued_urls.peak <= limits.queued_urls.capacity
+    assert limits.queued_urls.occupancy == 0
+
+
+@pytest.mark.unit
+def test_no_more_than_max_items_are_processed(monkeypatch) -> None:
+    processed = list()
+    # image 0 finishes once link 2 is pulled, images 1 and 2 once link 3 is pulled (or after a second),
+    # so images 1 and 2 are yielded within one drain
+    finished = {alt: threading.Event() for alt in ["0", "1", "2"]}
+
+    def fake_fetch_google_image_urls(**kwargs):
+        for n in range(100):
+            if n == 2:
+                finished["0"].set()
+            if n == 3:
+                finished["1"].set()
+                finished["2"].set()
+            yield {"src": f"http://example.com/{n}.jpg", "alt": str(n)}
+
+    def fake_process_image(image_link, query, **kwargs):
+        processed.append(image_link["alt"])
+        if image_link["alt"] in finished:
+            finished[image_link["alt"]].wait(1)
+        return ManifestDocument({"i": None, "query": query}), None
+
+    monkeypatch.setattr(query, "get_webdriver", lambda **kwargs: nullcontext(None))
+    monkeypatch.setattr(
+        browserdriver, "fetch_google_image_urls", fake_fetch_google_image_urls
+    )
+    monkeypatch.setattr(query, "process_image", fake_process_image)
+
+    documents = list(
+        query.get_google_images(
+            query_terms="dog",
+            store=Path(tempfile.mkdtemp()),
+            max_items=3,
+            language="en",
+            browser="Firefox",
+            acceptable_error_rate=1.0,
+        )
+    )
+
+    assert [document["i"] for document in documents] == [1, 2, 3]
+    assert sorted(processed) == ["0", "1", "2"]
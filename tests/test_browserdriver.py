@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+import threading
+import time
+from urllib.parse import unquote
+
+import pytest
+
+from qloader import browserdriver
+from qloader.browserdriver import get_browser_options
+
+
+@pytest.mark.unit
+def test_lean_firefox_profile() -> None:
+    options = get_browser_options("Firefox", profile="lean")
+
+    assert options.preferences["gfx.downloadable_fonts.enabled"] is False
+    assert "permissions.default.image" not in options.preferences
+
+    options = get_browser_options("Firefox", profile="lean-no-images")
+    assert options.preferences["permissions.default.image"] == 2
+
+    # blocked hosts and their subdomains go to a closed proxy port, like Chrome's MAP *.host rules
+    assert options.preferences["network.proxy.type"] == 2
+    pac = unquote(options.preferences["network.proxy.autoconfig_url"])
+    assert 'dnsDomainIs(host, ".doubleclick.net")' in pac
+    assert 'host == "doubleclick.net"' in pac
+
+
+@pytest.mark.unit
+def test_lean_chrome_profile() -> None:
+    options = get_browser_options("Chrome", profile="lean-no-images")
+
+    assert "--disable-extensions" in options.arguments
+    assert "--blink-settings=imagesEnabled=false" in options.arguments
+    assert any(
+        argument.startswith("--host-resolver-rules=") for argument in options.arguments
+    )
+
+
+@pytest.mark.unit
+def test_default_profile_is_unchanged() -> None:
+    options = get_browser_options("Chrome")
+
+    assert options.arguments == ["--headless", "--no-sandbox"]
+
+
+@pytest.mark.unit
+def test_unknown_profile() -> None:
+    with pytest.raises(ValueError):
+        get_browser_options("Chrome", profile="bloated")
+
+
+class FakeElement:
+    def __init__(self, src):
+        self.src = src
+
+    def get_attribute(self, name):
+        return self.src
+
+
+@pytest.mark.unit
+def test_alternate_is_the_clicked_thumbnail() -> None:
+    chosen = "https://example.com/dog.jpg"
+    thumbnail = FakeElement("data:image/jpeg;base64,dog")
+    # the preview may still hold a neighbouring panel's gstatic thumbnail
+    candidates = [
+        FakeElement(chosen),
+        FakeElement("https://encrypted-tbn0.gstatic.com/images?q=cat"),
+    ]
+
+    assert (
+        browserdriver.pick_alternate_src(thumbnail, candidates, chosen)
+        == "data:image/jpeg;base64,dog"
+    )
+    assert (
+        browserdriver.pick_alternate_src(FakeElement(None), candidates, chosen)
+        == "https://encrypted-tbn0.gstatic.com/images?q=cat"
+    )
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def new_window(self, kind):
+        self.driver.handles.append(f"tab-{len(self.driver.handles)}")
+        self.driver.current_window_handle = self.driver.handles[-1]
+
+    def window(self, handle):
+        self.driver.current_window_handle = handle
+
+
+class FakeDriver:
+    def __init__(self):
+        self.handles = ["tab-0"]
+        self.current_window_handle = "tab-0"
+        self.switch_to = FakeSwitchTo(self)
+
+    def close(self):
+        self.handles.remove(self.current_window_handle)
+
+
+@pytest.mark.unit
+def test_tabs_are_interleaved(monkeypatch) -> None:
+    def fake_scrape(query, driver, sleep_between_interactions, **kwargs):
+        # every interaction must happen in the tab this scrape belongs to
+        handle = {"slow": "tab-0", "fast": "tab-1"}[query]
+        if query == "slow":
+            yield browserdriver.Pause(0.2)
+        assert driver.current_window_handle == handle
+        yield {"src": f"http://{query}/1.jpg", "alt": query}
+        assert driver.current_window_handle == handle
+        yield {"src": "http://shared/1.jpg", "alt": query}
+
+    monkeypatch.setattr(browserdriver, "scrape_google_images", fake_scrape)
+
+    driver = FakeDriver()
+    results = list(
+        browserdriver.fetch_google_image_urls_in_tabs(
+            driver, [{"query": "slow"}, {"query": "fast"}]
+        )
+    )
+
+    # the fast tab is not held up by the slow tab's pause, and links found by both are yielded once
+    assert [(tab, link["src"]) for tab, link in results] == [
+        (1, "http://fast/1.jpg"),
+        (1, "http://shared/1.jpg"),
+        (0, "http://slow/1.jpg"),
+    ]
+    # only the first tab is left open for the next query
+    assert driver.handles == ["tab-0"]
+    assert driver.current_window_handle == "tab-0"
+
+
+@pytest.mark.unit
+def test_cancel_interrupts_pauses(monkeypatch) -> None:
+    def fake_scrape_google_images(**kwargs):
+        yield {"src": "http://example.com/0.jpg", "alt": "0"}
+        while True:
+            yield browserdriver.Pause(8)
+
+    monkeypatch.setattr(
+        browserdriver, "scrape_google_images", fake_scrape_google_images
+    )
+    cancel = threading.Event()
+    threading.Timer(0.2, cancel.set).start()
+
+    start = time.time()
+    image_links = list(
+        browserdriver.fetch_google_image_urls("dogs", driver=None, cancel=cancel)
+    )
+
+    assert len(image_links) == 1
+    assert time.time() - start < 2
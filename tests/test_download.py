@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+import base64
+import socket
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+
+import pytest
+from conftest import data_uri, png_bytes
+
+from qloader.backpressure import PipelineLimits
+from qloader.download import LatencyBudget, fetch_content, hedged_fetch
+from qloader.query import RelatedImageIndex, process_image
+
+
+class StubImageHandler(BaseHTTPRequestHandler):
+    requests_seen = list()
+
+    def do_GET(self):
+        self.requests_seen.append(self.path)
+        if self.path.startswith("/slow"):
+            time.sleep(2)
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.path.startswith("/image"):
+            body = png_bytes("red")
+        else:
+            body = self.path.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.requests_seen.append(f"HEAD {self.path}")
+        if self.path.startswith("/slow"):
+            time.sleep(2)
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def stub_server(serve_http):
+    return serve_http(StubImageHandler)
+
+
+@pytest.mark.unit
+def test_latency_budget_percentile() -> None:
+    budget = LatencyBudget(percentile=0.9, min_samples=10, initial=3.0, floor=0.0)
+    assert budget.threshold() == 3.0  # not enough samples yet
+
+    for i in range(1, 101):
+        budget.record(i / 100)
+
+    assert budget.threshold() == pytest.approx(0.91)
+
+
+@pytest.mark.unit
+def test_fetch_content_data_uri() -> None:
+    payload = base64.b64encode(b"thumbnail").decode("ascii")
+    assert fetch_content(f"data:image/jpeg;base64,{payload}") == (b"thumbnail", None)
+
+
+@pytest.mark.unit
+def test_hedged_fetch_fast_origin_wins(stub_server) -> None:
+    budget = LatencyBudget(initial=1.0)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        result = hedged_fetch(
+            f"{stub_server}/origin", f"{stub_server}/alternate", budget, executor
+        )
+
+    assert result.source == "origin"
+    assert result.content == b"/origin"
+    assert not result.hedged
+
+
+@pytest.mark.unit
+def test_hedged_fetch_slow_origin_is_hedged(stub_server) -> None:
+    budget = LatencyBudget(initial=0.2)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        result = hedged_fetch(
+            f"{stub_server}/slow", f"{stub_server}/alternate", budget, executor
+        )
+
+    assert result.source == "alternate"
+    assert result.content == b"/alternate"
+    assert result.hedged
+    assert result.seconds < 1.5
+
+
+@pytest.mark.unit
+def test_hedged_fetch_budget_tracks_the_origin(stub_server) -> None:
+    budget = LatencyBudget(percentile=0.5, min_samples=2, initial=0.1, floor=0.0)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for _ in range(2):
+            result = hedged_fetch(f"{stub_server}/slow", data_uri(0), budget, executor)
+            assert result.source == "alternate"
+    # the instant data: URI wins, the budget still learns how slow the origin is
+    assert budget.threshold() > 1.5
+
+
+@pytest.mark.unit
+def test_hedged_fetch_failed_origin_falls_back(stub_server) -> None:
+    budget = LatencyBudget(initial=1.0)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        result = hedged_fetch(
+            f"{stub_server}/missing", f"{stub_server}/alternate", budget, executor
+        )
+
+    assert result.source == "alternate"
+
+
+@pytest.mark.unit
+def test_related_images_are_deduplicated(stub_server) -> None:
+    folder = Path(tempfile.TemporaryDirectory().name)
+    url = f"{stub_server}/image/related"
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        related_index = RelatedImageIndex(folder, executor)
+        futures = [related_index.submit(url) for _ in range(5)]
+        entries = [future.result() for future in futures]
+
+    assert len({entry["image_id"] for entry in entries}) == 1
+    assert related_index.hits == 4
+    assert StubImageHandler.requests_seen.count("/image/related") == 1
+
+    # a later run sharing the folder reuses the index instead of downloading again
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        related_index = RelatedImageIndex(folder, executor)
+        assert related_index.submit(url).result() == entries[0]
+
+    assert StubImageHandler.requests_seen.count("/image/related") == 1
+
+
+def dead_origin() -> str:
+    # nothing listens on a port that was just released
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/image/dead"
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("origin", ["slow", "dead"])
+def test_process_image_rescued_by_alternate(stub_server, origin) -> None:
+    src = f"{stub_server}/slow/image" if origin == "slow" else dead_origin()
+    image_link = {
+        "src": src,
+        "alternate_src": f"{stub_server}/image/alternate",
+        "alt": origin,
+    }
+    executor = ThreadPoolExecutor(max_workers=2)
+    start = time.time()
+    manifest_document, _ = process_image(
+        image_link,
+        "rescued",
+        store=Path(tempfile.mkdtemp()),
+        limits=PipelineLimits(),
+        latency_budget=LatencyBudget(initial=0.2),
+        fetch_pool=executor,
+    )
+    executor.shutdown(wait=False)
+
+    assert time.time() - start < 1.5
+    assert manifest_document["fetch_source"] == "alternate"
+    assert manifest_document["image_url"] == src
+    # the headers come from the alternate's response, the origin is not asked again
+    assert int(manifest_document["headers"]["content_length"]) > 0
+    assert "HEAD /slow/image" not in StubImageHandler.requests_seen
+
+
+@pytest.mark.unit
+def test_download_slot_held_by_losing_origin(stub_server) -> None:
+    limits = PipelineLimits(max_inflight_downloads=1)
+    executor = ThreadPoolExecutor(max_workers=2)
+    manifest_document, _ = process_image(
+        {"src": f"{stub_server}/slow/image", "alternate_src": data_uri(0), "alt": ""},
+        "slot",
+        store=Path(tempfile.mkdtemp()),
+        limits=limits,
+        latency_budget=LatencyBudget(initial=0.2),
+        fetch_pool=executor,
+    )
+    assert manifest_document["fetch_source"] == "alternate"
+    # the origin is still downloading, the next image waits for it
+    assert limits.downloads.saturated
+
+    executor.shutdown(wait=True)
+    assert limits.downloads.occupancy == 0
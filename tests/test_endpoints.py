@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+import tempfile
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+
+import pytest
+from conftest import png_bytes
+
+import qloader
+from qloader import httpsearch
+from qloader.args import get_parser
+from qloader.endpoints import Endpoint, get_endpoint
+from qloader.query import UnimplementedEndpointError
+
+COLORS = ["red", "green", "blue", "yellow", "purple"]
+
+
+class StubGoogleHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        host = f"http://127.0.0.1:{self.server.server_address[1]}"
+        if self.path.startswith("/search") and "SOCS=" not in self.headers.get(
+            "Cookie", ""
+        ):
+            # like google for visitors from the EU
+            self.send_response(302)
+            self.send_header("Location", f"{host}/consent")
+            self.end_headers()
+            return
+        if self.path.startswith("/search"):
+            # the same inline data layout google uses: thumbnail entry followed by the original
+            entries = ",".join(
+                f'["{host}/gstatic.com/thumb/{color}",100,100],["{host}/image/{color}.png",800,600]'
+                for color in COLORS
+            )
+            body = f"<html><script>var data = [{entries}];</script></html>".encode()
+            content_type = "text/html"
+        elif "/image/" in self.path or "/thumb/" in self.path:
+            body = png_bytes(self.path.split("/")[-1].split(".")[0], (16, 16))
+            content_type = "image/png"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def stub_google(serve_http):
+    return serve_http(StubGoogleHandler)
+
+
+@pytest.mark.unit
+def test_parse_image_links() -> None:
+    html = r'["https://encrypted-tbn0.gstatic.com/images?q=tbn",90,120],["https://example.com/dog.jpg?a=1&b=2",600,800]'
+    assert httpsearch.parse_image_links(html) == [
+        {
+            "src": "https://example.com/dog.jpg?a=1&b=2",
+            "alt": "",
+            "alternate_src": "https://encrypted-tbn0.gstatic.com/images?q=tbn",
+        }
+    ]
+
+
+@pytest.mark.unit
+def test_run_picks_browserless_backend(stub_google, monkeypatch) -> None:
+    monkeypatch.setattr(httpsearch, "GOOGLE_SEARCH_URL", f"{stub_google}/search")
+    output_path = Path(tempfile.mkdtemp())
+
+    images_metadata = qloader.run(
+        endpoint="google-images",
+        query_terms="cute dog",
+        output_path=output_path,
+        max_items=3,
+        metadata={"test-key": "test-value"},
+    )
+
+    assert len(images_metadata) == 3
+    assert images_metadata[0]["backend"] == "google-images-http"
+    assert images_metadata[0]["image_url"] == f"{stub_google}/image/red.png"
+    assert images_metadata[0]["headers"]["content_type"] == "image/png"
+    assert len(list(output_path.glob("*.jpg"))) == 3
+
+
+@pytest.mark.unit
+def test_javascript_queries_keep_the_browser() -> None:
+    backend = get_endpoint("google-images")()
+    assert backend.needs_javascript(track_related=True)
+    assert not backend.needs_javascript(track_related=False)
+    # asking for a browser by name gets one
+    assert get_endpoint("google-images")(browser="Chrome").needs_javascript()
+
+
+@pytest.mark.unit
+def test_cli_backend_choice() -> None:
+    args = get_parser().parse_args(["--query-terms", "dogs"])
+    assert args.browser is None and args.browserless is None
+    args = get_parser().parse_args(["--query-terms", "dogs", "--browserless"])
+    assert args.browserless is True
+
+
+@pytest.mark.unit
+def test_registered_endpoint(stub_google, register_test_endpoints) -> None:
+    class ColorsEndpoint(Endpoint):
+        def image_links(self, queries):
+            for color in COLORS:
+                yield 0, {"src": f"{stub_google}/image/{color}.png", "alt": color}
+
+    register_test_endpoints({"test-colors": ColorsEndpoint})
+
+    images_metadata = qloader.run(
+        endpoint="test-colors",
+        query_terms="colors",
+        output_path=Path(tempfile.mkdtemp()),
+        max_items=5,
+    )
+
+    assert [image["alt"] for image in images_metadata] == COLORS
+
+
+@pytest.mark.unit
+def test_unknown_endpoint() -> None:
+    with pytest.raises(UnimplementedEndpointError):
+        get_endpoint("altavista")
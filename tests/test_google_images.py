@@ -19,6 +19,7 @@ def test_google_images_query_chrome_100() -> None:
         language="en",
         browser="Chrome",
         keep_head=False,
+        browserless=False,
     )
 
     assert (len(images_metadata) / max_items) > 0.95  # assert 95% fill rate
@@ -47,6 +48,7 @@ def test_google_images_query_firefox_10() -> None:
         language="en",
         browser="Firefox",
         keep_head=False,
+        browserless=False,
     )
 
     assert (len(images_metadata) / max_items) > 0.95  # assert 95% fill rate
@@ -76,6 +78,7 @@ def test_google_images_region_specific_query_20() -> None:
         browser="Chrome",
         extra_query_params={"cr": "countryFR"},
         keep_head=False,
+        browserless=False,
     )
 
     assert (
@@ -99,6 +102,7 @@ def test_google_images_track_related_10() -> None:
         extra_query_params={"cr": "countryCA"},
         track_related=True,
         keep_head=False,
+        browserless=False,
     )
 
 
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+HEAVY_MODULES = ["selenium", "requests", "PIL", "imagehash", "numpy"]
+
+# import qloader and build the CLI parser the way a short-lived worker or `--help` call would
+STARTUP = """
+import json, sys, time
+start = time.perf_counter()
+import qloader
+import qloader.args
+qloader.args.get_parser()
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def measure_startup() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", STARTUP],
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+@pytest.mark.unit
+def test_import_does_not_load_heavy_dependencies() -> None:
+    modules = measure_startup()["modules"]
+    for heavy_module in HEAVY_MODULES:
+        assert heavy_module not in modules, f"import qloader loaded {heavy_module}"
+
+
+@pytest.mark.unit
+def test_import_time_budget() -> None:
+    # generous bound to stay stable on slow CI runners, eager imports took ~0.5s
+    assert min(measure_startup()["elapsed"] for _ in range(3)) < 0.15
+
+
+@pytest.mark.unit
+def test_run_is_resolved_on_access() -> None:
+    import qloader
+    from qloader.query import run
+
+    assert qloader.run is run
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import json
+import logging
+import tempfile
+import threading
+from pathlib import Path
+
+import pytest
+
+from qloader import logger as qlogger
+
+
+@pytest.mark.unit
+def test_structured_queue_logging() -> None:
+    log_file = Path(tempfile.NamedTemporaryFile(suffix=".jsonl").name)
+    log = qlogger.get_logger(
+        "test_structured_queue_logging",
+        log_file=log_file,
+        use_queue=True,
+        structured=True,
+    )
+    qlogger.set_log_context(query_id="abc")
+
+    log.debug("saved %d images", 3)
+    qlogger.stop_listener()
+
+    record = json.loads(log_file.read_text().splitlines()[-1])
+    assert record["message"] == "saved 3 images"
+    assert record["query_id"] == "abc"
+    assert record["run_id"] == qlogger.RUN_ID
+
+
+@pytest.mark.unit
+def test_log_context_per_query() -> None:
+    seen = dict()
+    both_set = threading.Barrier(2)
+
+    def query(query_id):
+        qlogger.set_log_context(query_id=query_id)
+        # the other query sets its context before this one logs from its pool
+        both_set.wait()
+        with qlogger.ContextThreadPoolExecutor(max_workers=1) as pool:
+            seen[query_id] = pool.submit(qlogger.get_log_context).result()["query_id"]
+
+    threads = [threading.Thread(target=query, args=(name,)) for name in ["a", "b"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert seen == {"a": "a", "b": "b"}
+    assert qlogger.get_log_context().get("query_id") not in ["a", "b"]
+
+
+@pytest.mark.unit
+def test_log_payload_is_lazy_and_capped(monkeypatch) -> None:
+    monkeypatch.setattr(qlogger, "PAYLOAD_DIR", Path(tempfile.mkdtemp()))
+    monkeypatch.setattr(qlogger, "MAX_PAYLOAD_FILES", 2)
+
+    quiet = qlogger.get_logger("test_log_payload_quiet", console_level=logging.INFO)
+    assert qlogger.log_payload(quiet, "page", lambda: 1 / 0) is None
+
+    log = qlogger.get_logger("test_log_payload", console_level=logging.DEBUG)
+    written = [qlogger.log_payload(log, "page", lambda: "<html/>") for _ in range(3)]
+
+    assert written[0].read_text() == "<html/>"
+    assert written[2] is None
+    assert len(list(qlogger.PAYLOAD_DIR.iterdir())) == 2
+
+    # the cap is per query, the next query gets its own payload files
+    def next_query():
+        qlogger.set_log_context(query_id="next")
+        qlogger.log_payload(log, "page", lambda: "<html/>")
+        # the count is shared with the query's own pools
+        with qlogger.ContextThreadPoolExecutor(max_workers=1) as query_pool:
+            return query_pool.submit(
+                qlogger.log_payload, log, "page", lambda: "<html/>"
+            ).result()
+
+    with qlogger.ContextThreadPoolExecutor(max_workers=1) as pool:
+        payload_file = pool.submit(next_query).result()
+    assert payload_file.name == f"{qlogger.RUN_ID}-next-page-1.txt"
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import json
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from qloader.manifest import ManifestDocument, write_manifest
+
+
+def make_documents(query: str) -> list:
+    return [
+        ManifestDocument(
+            {
+                "i": 1,
+                "query": query,
+                "endpoint": "google-images",
+                "image_id": "abc",
+                "image_url": "http://example.com/a.jpg",
+                "alt": "a dog",
+                "headers": {
+                    "content_type": "image/jpeg",
+                    "content_length": "1024",
+                    "last_modified": 1600000000000,
+                },
+                "related": [
+                    ManifestDocument(
+                        {
+                            "i": 1,
+                            "query": query,
+                            "image_id": "def",
+                            "image_url": "http://example.com/b.jpg",
+                            "headers": None,
+                            "alt": "another dog",
+                        }
+                    )
+                ],
+                "test-key": "test-value",
+            }
+        )
+    ]
+
+
+@pytest.mark.unit
+def test_json_manifest_serializes_related() -> None:
+    path = Path(tempfile.mkdtemp()).joinpath("manifest.json")
+    write_manifest(make_documents("dog"), path, run_id="run", query_id="q1")
+
+    manifest = json.loads(path.read_text())
+    assert manifest[0]["related"][0]["image_id"] == "def"
+
+
+@pytest.mark.unit
+def test_sqlite_manifest_appends_across_runs() -> None:
+    path = Path(tempfile.mkdtemp()).joinpath("manifest.sqlite")
+    write_manifest(make_documents("dog"), path, run_id="run-1", query_id="q1")
+    write_manifest(make_documents("cat"), path, run_id="run-2", query_id="q2")
+
+    connection = sqlite3.connect(path)
+    rows = connection.execute(
+        "SELECT run_id, query, content_length, metadata FROM images WHERE content_type = ? ORDER BY run_id",
+        ("image/jpeg",),
+    ).fetchall()
+    related = connection.execute(
+        "SELECT parent_image_id, image_id FROM related WHERE query_id = 'q2'"
+    ).fetchall()
+    plan = connection.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM images WHERE query = 'dog'"
+    ).fetchall()
+    connection.close()
+
+    assert [row[:3] for row in rows] == [("run-1", "dog", 1024), ("run-2", "cat", 1024)]
+    assert json.loads(rows[0][3]) == {"test-key": "test-value"}
+    assert related == [("abc", "def")]
+    assert "images_query" in str(plan)
+
+
+@pytest.mark.unit
+def test_parquet_manifest_dataset() -> None:
+    dataset = pytest.importorskip("pyarrow.dataset")
+    path = Path(tempfile.mkdtemp()).joinpath("manifest.parquet")
+    write_manifest(make_documents("dog"), path, run_id="run-1", query_id="q1")
+    write_manifest(make_documents("cat"), path, run_id="run-2", query_id="q2")
+
+    table = dataset.dataset(path).to_table()
+    assert sorted(table.column("query").to_pylist()) == ["cat", "dog"]
+    assert table.column("related").to_pylist()[0][0]["image_id"] == "def"
+    assert table.column("headers").to_pylist()[0]["content_length"] == 1024
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import itertools
+import tempfile
+from pathlib import Path
+
+import pytest
+from conftest import data_uri
+
+import qloader
+from qloader.endpoints import Endpoint
+from qloader.monitor import ErrorRateMonitor
+from qloader.query import UnacceptableErrorRateError
+
+BROKEN_IMAGE = "data:image/png,not%20a%20png"
+SCRAPED = list()
+
+
+class BrokenEndpoint(Endpoint):
+    """
+    Every image link fails to decode, like a query whose selectors picked up the wrong elements
+    """
+
+    def image_links(self, queries):
+        for index in itertools.count():
+            SCRAPED.append(index)
+            yield 0, {"src": f"{BROKEN_IMAGE}{index}", "alt": str(index)}
+
+
+class FlakyEndpoint(Endpoint):
+    """
+    Every other image link fails to decode, all failures are the same exception type
+    """
+
+    def image_links(self, queries):
+        for index in range(20):
+            src = data_uri(index) if index % 2 == 0 else f"{BROKEN_IMAGE}{index}"
+            yield 0, {"src": src, "alt": str(index)}
+
+
+@pytest.fixture
+def monitor_endpoints(register_test_endpoints):
+    register_test_endpoints(
+        {"test-broken": BrokenEndpoint, "test-flaky": FlakyEndpoint}
+    )
+
+
+@pytest.mark.unit
+def test_monitor_window() -> None:
+    monitor = ErrorRateMonitor(threshold=0.5, min_samples=4, window=4)
+    for _ in range(3):
+        monitor.record("download", TimeoutError("slow origin"))
+    # not enough samples yet
+    monitor.check()
+
+    monitor.record("download", TimeoutError("slow origin"))
+    with pytest.raises(UnacceptableErrorRateError) as error:
+        monitor.check()
+    assert "download failed 4 of its last 4 attempts" in str(error.value)
+    assert "TimeoutError x4" in str(error.value)
+    assert error.value.stats["download"]["failures"] == 4
+
+    # old failures roll out of the window, the totals are kept
+    for _ in range(3):
+        with monitor.stage("download"):
+            pass
+    monitor.check()
+    assert monitor.stats()["download"] == {
+        "attempts": 7,
+        "failures": 4,
+        "window_rate": 0.25,
+        "errors": {"TimeoutError": 4},
+    }
+
+
+@pytest.mark.unit
+def test_early_abort(monitor_endpoints) -> None:
+    SCRAPED.clear()
+    with pytest.raises(UnacceptableErrorRateError) as error:
+        qloader.run(
+            endpoint="test-broken",
+            query_terms="broken",
+            output_path=Path(tempfile.mkdtemp()),
+            max_items=1000,
+            monitor=ErrorRateMonitor(threshold=0.5, min_samples=10, window=20),
+        )
+    assert "aborting early, decode failed" in str(error.value)
+    # the scraper is stopped long before max_items links are tried
+    assert len(SCRAPED) < 100
+
+
+@pytest.mark.unit
+def test_error_rate_counts_failures(monitor_endpoints) -> None:
+    # one distinct exception type used to pass as a 1/max_items error rate
+    with pytest.raises(UnacceptableErrorRateError) as error:
+        qloader.run(
+            endpoint="test-flaky",
+            query_terms="flaky",
+            output_path=Path(tempfile.mkdtemp()),
+            max_items=10,
+            acceptable_error_rate=0.2,
+            monitor=ErrorRateMonitor(threshold=None),
+        )
+    assert str(error.value) == "9/19 images failed to download!"
+
+
+@pytest.mark.unit
+def test_error_counts_in_results(monitor_endpoints) -> None:
+    documents = qloader.run(
+        endpoint="test-flaky",
+        query_terms="flaky",
+        output_path=Path(tempfile.mkdtemp()),
+        max_items=10,
+        acceptable_error_rate=0.6,
+    )
+    assert len(documents) == 10
+    assert documents[0]["error_counts"]["decode"] == {"attempts": 19, "failures": 9}
+    assert documents[0]["error_counts"]["download"]["failures"] == 0
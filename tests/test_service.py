@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+import itertools
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pytest
+from conftest import data_uri
+
+from qloader.endpoints import Endpoint
+from qloader.service import FINISHED_STATES, JobQueue, Service, make_server
+
+WARM_STARTS = list()
+RELEASE_STUCK = threading.Event()
+
+
+class WarmEndpoint(Endpoint):
+    def image_links(self, queries):
+        # stands in for a browser, started once per worker
+        self.options["warm"].get("browser", lambda: WARM_STARTS.append(1) or object())
+        for index in range(10):
+            yield 0, {"src": data_uri(index), "alt": f"{queries[0]['query']} {index}"}
+
+
+class EndlessEndpoint(Endpoint):
+    def image_links(self, queries):
+        for index in itertools.count():
+            time.sleep(0.02)
+            yield 0, {"src": data_uri(index), "alt": str(index)}
+
+
+class SlowStartEndpoint(Endpoint):
+    def image_links(self, queries):
+        # like a browser waiting on the page, a cancelled query stops waiting
+        if self.cancel.wait(8):
+            return
+        yield 0, {"src": data_uri(0), "alt": "0"}
+
+
+class StuckEndpoint(Endpoint):
+    def image_links(self, queries):
+        # ignores cancel altogether
+        RELEASE_STUCK.wait(8)
+        yield 0, {"src": data_uri(0), "alt": "0"}
+
+
+@pytest.fixture
+def service_url(register_test_endpoints):
+    register_test_endpoints(
+        {
+            "test-warm": WarmEndpoint,
+            "test-endless": EndlessEndpoint,
+            "test-slow-start": SlowStartEndpoint,
+            "test-stuck": StuckEndpoint,
+        }
+    )
+    service = Service(Path(tempfile.mkdtemp()), workers=1, poll_interval=0.05)
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    service.start()
+    yield service, f"http://127.0.0.1:{server.server_address[1]}"
+    service.stop(drain_timeout=1)
+    server.shutdown()
+
+
+def request(url, method="GET", body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    with urllib.request.urlopen(
+        urllib.request.Request(url, data, method=method)
+    ) as response:
+        return response.status, response.read()
+
+
+def wait_for(service, job_id, condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = service.queue.get(job_id)
+        if condition(job):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"timed out waiting on {job}")
+
+
+@pytest.mark.unit
+def test_jobs_share_a_warm_worker(service_url) -> None:
+    service, url = service_url
+    WARM_STARTS.clear()
+
+    job_ids = list()
+    for query in ["red", "blue"]:
+        status, body = request(
+            f"{url}/jobs",
+            "POST",
+            {"endpoint": "test-warm", "query_terms": query, "max_items": 4},
+        )
+        assert status == 201
+        job_ids.append(json.loads(body)["id"])
+
+    # the results stream ends when the job is done
+    _, results = request(f"{url}/jobs/{job_ids[1]}/results")
+    documents = [json.loads(line) for line in results.decode().splitlines()]
+    assert [document["alt"] for document in documents] == [
+        f"blue {i}" for i in range(4)
+    ]
+    assert documents[0]["job_id"] == job_ids[1]
+
+    for job_id in job_ids:
+        job = json.loads(request(f"{url}/jobs/{job_id}")[1])
+        assert job["status"] == "done"
+        assert job["documents"] == 4
+    _, manifest = request(f"{url}/jobs/{job_ids[0]}/manifest")
+    assert len(json.loads(manifest)) == 4
+    # the second job reused the first job's warm resources
+    assert len(WARM_STARTS) == 1
+
+
+@pytest.mark.unit
+def test_cancel_running_job(service_url) -> None:
+    service, url = service_url
+    _, body = request(
+        f"{url}/jobs",
+        "POST",
+        {"endpoint": "test-endless", "query_terms": "forever", "max_items": 10000},
+    )
+    job_id = json.loads(body)["id"]
+    wait_for(service, job_id, lambda job: job["documents"] > 2)
+
+    status, _ = request(f"{url}/jobs/{job_id}", "DELETE")
+    assert status == 202
+    job = wait_for(service, job_id, lambda job: job["status"] != "running")
+    assert job["status"] == "cancelled"
+    assert not service.manifest_file(job_id).exists()
+
+
+@pytest.mark.unit
+def test_drain_requeues_interrupted_jobs(service_url) -> None:
+    service, url = service_url
+    queue = JobQueue(service.queue.path)
+    running = queue.submit({"endpoint": "test-endless", "query_terms": "forever"})
+    wait_for(service, running["id"], lambda job: job["documents"] > 0)
+    queued = queue.submit({"endpoint": "test-warm", "query_terms": "later"})
+
+    service.stop(drain_timeout=0.2)
+
+    # nothing is lost, both jobs are left for the next start
+    assert queue.get(running["id"])["status"] == "queued"
+    assert queue.get(queued["id"])["status"] == "queued"
+    with pytest.raises(urllib.error.HTTPError) as error:
+        request(f"{url}/jobs", "POST", {"query_terms": "too late"})
+    assert error.value.code == 503
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("endpoint", ["test-slow-start", "test-stuck"])
+def test_stop_is_bounded(service_url, endpoint) -> None:
+    service, _ = service_url
+    RELEASE_STUCK.clear()
+    job = service.queue.submit({"endpoint": endpoint, "query_terms": "waiting"})
+    wait_for(service, job["id"], lambda job: job["status"] == "running")
+
+    start = time.time()
+    service.stop(drain_timeout=0.2, cancel_timeout=0.5)
+    RELEASE_STUCK.set()
+
+    assert time.time() - start < 2
+    assert service.queue.get(job["id"])["status"] == "queued"
+
+
+@pytest.mark.unit
+def test_expired_leases_are_claimed_again() -> None:
+    queue = JobQueue(
+        Path(tempfile.mkdtemp()).joinpath("jobs.sqlite"), lease_timeout=0.5
+    )
+    job = queue.submit({"query_terms": "crashed"})
+    assert queue.claim("crashed-service")["worker"] == "crashed-service"
+
+    # a live service renews its lease
+    time.sleep(0.3)
+    queue.heartbeat([job["id"]])
+    time.sleep(0.3)
+    assert queue.claim("next-service") is None
+
+    # a crashed one does not, its job is picked up by the next claim
+    time.sleep(0.3)
+    claimed = queue.claim("next-service")
+    assert claimed["id"] == job["id"]
+    assert claimed["worker"] == "next-service"
+
+
+@pytest.mark.unit
+def test_invalid_job(service_url) -> None:
+    _, url = service_url
+    for params in [
+        {"query_terms": "dogs", "output_path": "/"},
+        # the webdriver binary is chosen by whoever runs the service, not by API clients
+        {"query_terms": "dogs", "driver_path": "/bin/sh"},
+        {"query_terms": "dogs", "keep_head": True},
+        # a path would have the service read a file of its host
+        {"query_terms": "dogs", "metadata": "/etc/passwd"},
+        {"max_items": 4},
+    ]:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            request(f"{url}/jobs", "POST", params)
+        assert error.value.code == 400
+
+
+@pytest.mark.unit
+def test_malformed_job_fails(service_url) -> None:
+    service, url = service_url
+    # rows written to the database by another process skip submit()'s validation
+    connection = sqlite3.connect(service.queue.path, isolation_level=None)
+    for job_id, params in [
+        ("no-query", {"endpoint": "test-warm"}),
+        (
+            "file-metadata",
+            {"endpoint": "test-warm", "query_terms": "dogs", "metadata": "/etc/passwd"},
+        ),
+    ]:
+        connection.execute(
+            "INSERT INTO jobs (id, params, status, submitted_at) VALUES (?, ?, 'queued', '0')",
+            (job_id, json.dumps(params)),
+        )
+    connection.close()
+    for job_id in ["no-query", "file-metadata"]:
+        job = wait_for(service, job_id, lambda job: job["status"] in FINISHED_STATES)
+        assert job["status"] == "failed"
+        assert job["error"].startswith("InvalidJobError")
+
+    # the worker survived them
+    _, body = request(
+        f"{url}/jobs",
+        "POST",
+        {"endpoint": "test-warm", "query_terms": "cats", "max_items": 2},
+    )
+    job_id = json.loads(body)["id"]
+    assert wait_for(service, job_id, lambda job: job["status"] == "done")